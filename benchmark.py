@@ -0,0 +1,487 @@
+#!./.venv/bin/python3
+
+"""
+Micro-benchmarks for the hot paths of fefe.py, run against saved monthly pages
+(see --output of fefe.py), e.g.:
+
+    ./benchmark.py month-parser --input _data.html --start 2015-01 --limit 12
+    ./benchmark.py word-count --input _data.html --start 2015-01 --limit 12
+    ./benchmark.py domains --input _data.html --start 2015-01 --limit 12
+    ./benchmark.py logging --input _data.html --start 2015-01 --limit 1
+
+and for the topic extraction of phase1_prepare_raw_data.py, on the scraped messages:
+
+    ./benchmark.py extractor --input messages.json
+
+and for reading large JSON files entry by entry, as messages.json is read by the phase1 scripts:
+
+    ./benchmark.py json-reader --input words.json
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import tempfile
+import time
+import warnings
+from collections import Counter
+
+from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+from dateutil.relativedelta import relativedelta
+from datetime import datetime
+
+import fefe
+from domain_names import host_of, normalize_host, registrable_domain
+
+
+def load_months(input_template, start, limit):
+    """Read up to `limit` saved months, starting at `start` (Y-m). Returns a list of (month, html)."""
+    months = []
+    current = datetime.strptime(start, "%Y-%m")
+    for _ in range(limit):
+        month = current.strftime("%Y%m")
+        try:
+            with open("{}{}".format(month, input_template), "r", encoding="utf8") as handle:
+                months.append((month, handle.read()))
+        except FileNotFoundError:
+            pass
+        current = current + relativedelta(months=+1)
+    return months
+
+
+def sanitize(html):
+    """The <a>-tag fix of fefe.parseMonth, shared by both parser paths."""
+    lines = []
+    for line in html.splitlines():
+        while line.count("<a") > line.count("</a>"):
+            line += "</a>"
+        lines.append(line)
+    return "".join(lines)
+
+
+def legacy_segment(html):
+    """The former approach: parse the month, serialize every <ul> and re-parse every <li>."""
+    soup = BeautifulSoup(html, features="html.parser")
+    lists = soup.find_all("ul", recursive=False) or soup.find_all("ul", recursive=True)
+    messages = []
+    for ul in lists:
+        parts = re.split(r"(<li[^>]*>)", str(ul))
+        for i in range(1, len(parts) - 1, 2):
+            li = BeautifulSoup(parts[i] + parts[i + 1].replace("</ul>", "") + "</li>", features="html.parser").find("li")
+            if li:
+                messages.append(li)
+    return messages
+
+
+def single_pass_segment(html):
+    """fefe.segmentMonth plus one parse per message."""
+    messages = []
+    for _, fragments in fefe.segmentMonth(html):
+        for fragment in fragments:
+            li = BeautifulSoup(fragment, features="html.parser").find("li")
+            if li:
+                messages.append(li)
+    return messages
+
+
+def measure(label, func, pages, repeat):
+    best = None
+    count = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = sum(len(func(html)) for html in pages)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print("  {:<12} {:>7} messages in {:>8.3f}s  {:>10.1f} messages/s".format(label, count, best, count / best if best else 0))
+    return best
+
+
+def bench_month_parser(args):
+    months = load_months(args.input, args.start, args.limit)
+    if not months:
+        print("No saved months found for {}".format(args.input))
+        return
+    pages = [sanitize(html) for _, html in months]
+    print("Month parser, {} months, best of {}:".format(len(pages), args.repeat))
+    legacy = measure("legacy", legacy_segment, pages, args.repeat)
+    single = measure("single-pass", single_pass_segment, pages, args.repeat)
+    print("  speedup: {:.2f}x".format(legacy / single if single else 0))
+
+
+def legacy_count_words(text, month, words_used):
+    """The former fefe.countWords: one uncompiled re.sub and two dict updates per word."""
+    clean = re.sub(r"(([\:\.\!\?1]+)([a-zA-Z1-9]+))", r"\2 \3", text.replace("[l] ", ""))
+    words = clean.lower().split()
+    for word in words:
+        clean_word = re.sub(r"[\W\_]", "", word)
+        if len(clean_word) >= fefe.minWordLength and not clean_word[0].isdigit():
+            words_used["sum"][clean_word] = words_used["sum"].get(clean_word, 0) + 1
+            words_used[month][clean_word] = words_used[month].get(clean_word, 0) + 1
+    return len(words)
+
+
+def message_texts(months):
+    """(month, text) of every message, as countWords gets them from fefe.parseMonth."""
+    texts = []
+    for month, html in months:
+        for message in single_pass_segment(sanitize(html)):
+            texts.append((month, fefe.cleanUpQuotes(message)["text"].get_text()))
+    return texts
+
+
+def bench_word_count(args):
+    texts = message_texts(load_months(args.input, args.start, args.limit))
+    if not texts:
+        print("No saved months found for {}".format(args.input))
+        return
+
+    def legacy():
+        words_used = {"sum": {}}
+        for month, text in texts:
+            words_used.setdefault(month, {})
+            legacy_count_words(text, month, words_used)
+        return words_used
+
+    def counter():
+        words_used = {"sum": Counter()}
+        for month, text in texts:
+            words_used.setdefault(month, Counter())
+            fefe.countWords(text, month, words_used, False)
+        for month, counts in words_used.items():
+            if month != "sum":
+                words_used["sum"].update(counts)
+        return words_used
+
+    print("Word count, {} messages, best of {}:".format(len(texts), args.repeat))
+    timings = {}
+    results = {}
+    for label, func in (("legacy", legacy), ("counter", counter)):
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            results[label] = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[label] = best
+        print("  {:<12} {:>8.3f}s  {:>10.1f} messages/s".format(label, best, len(texts) / best if best else 0))
+    print("  speedup: {:.2f}x".format(timings["legacy"] / timings["counter"] if timings["counter"] else 0))
+    same = all(dict(results["counter"][key]) == results["legacy"][key] for key in results["legacy"])
+    print("  identical counts: {}".format("yes" if same else "NO"))
+
+
+def legacy_get_domain(href):
+    """The former fefe.getDomain: two splits and an uncompiled re.sub per link."""
+    if href[:5] == "/?ts=" or href[:4] == "?ts=":
+        return "self"
+    domain = href.split("//")[-1].split("/")[0]
+    return re.sub(r"www[\d\.]*", "", domain)
+
+
+def bench_domains(args):
+    hrefs = []
+    for _, html in load_months(args.input, args.start, args.limit):
+        for message in single_pass_segment(sanitize(html)):
+            hrefs.extend(link.get("href") or link.get("ref") or "" for link in message.find_all("a")[1:])
+    if not hrefs:
+        print("No saved months found for {}".format(args.input))
+        return
+
+    def normalized():
+        normalize_host.cache_clear()
+        return [host_of(href) for href in hrefs]
+
+    def registrable():
+        normalize_host.cache_clear()
+        registrable_domain.cache_clear()
+        return [registrable_domain(host_of(href)) for href in hrefs]
+
+    print("Domains, {} links, best of {}:".format(len(hrefs), args.repeat))
+    timings = {}
+    results = {}
+    for label, func in (("legacy", lambda: [legacy_get_domain(href) for href in hrefs]), ("normalized", normalized), ("registrable", registrable)):
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            results[label] = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[label] = best
+        print("  {:<12} {:>8.3f}s  {:>10.1f} links/s  {:>6} distinct".format(label, best, len(hrefs) / best if best else 0, len(set(results[label]))))
+    print("  speedup: {:.2f}x".format(timings["legacy"] / timings["normalized"] if timings["normalized"] else 0))
+
+
+def legacy_log(message, indent=0, verbose=False):
+    """The former fefe.log, its callers format an f-string before every call."""
+    if not verbose:
+        return
+    if indent > 0:
+        print(" " * indent, end="")
+    print(message)
+
+
+def legacy_message_logs(index, total, message, domains, verbose):
+    """The log calls the former message loop of fefe.parseMonth made per message, incl. countWords and countDomains."""
+    legacy_log(f"Processing message {index + 1}/{total}", 12, verbose)
+    legacy_log("Stored raw HTML content", 14, verbose)
+    legacy_log("Cleaning up quotes", 14, verbose)
+    legacy_log(f"Found {message['quoteCount']} quotes", 16, verbose)
+    legacy_log("Stored cleaned text content", 14, verbose)
+    legacy_log("Counting words", 14, verbose)
+    legacy_log(f"Processing {message['wordCount']} words", 16, verbose)
+    legacy_log(f"Found {message['wordCount']} valid words (min length: {fefe.minWordLength})", 18, verbose)
+    legacy_log(f"Found {message['wordCount']} words", 16, verbose)
+    legacy_log(f"Found {len(domains) + 1} links", 14, verbose)
+    legacy_log(f"Message URL: {message['url']}", 16, verbose)
+    legacy_log(f"Timestamp: {message['timestamp']} (hex: {message['hexTimestamp']})", 16, verbose)
+    legacy_log("Counting domains", 14, verbose)
+    legacy_log(f"Counting domains for {len(domains)} links", 16, verbose)
+    for link_index, domain in enumerate(domains):
+        legacy_log(f"Link {link_index}: {domain}", 18, verbose)
+    legacy_log(f"Found {message['sourcesCount']} external references", 16, verbose)
+    legacy_log(f"Message {message['hexTimestamp']} successfully processed", 14, verbose)
+
+
+def lazy_message_logs(index, total, message, domains, verbose):
+    """The same calls with fefe.log, which only formats when verbose is set."""
+    log = fefe.log
+    log("Processing message %s/%s", 12, verbose, index + 1, total)
+    log("Stored raw HTML content", 14, verbose)
+    log("Cleaning up quotes", 14, verbose)
+    log("Found %s quotes", 16, verbose, message["quoteCount"])
+    log("Stored cleaned text content", 14, verbose)
+    log("Counting words", 14, verbose)
+    log("Processing %s words", 16, verbose, message["wordCount"])
+    log("Found %s valid words (min length: %s)", 18, verbose, message["wordCount"], fefe.minWordLength)
+    log("Found %s words", 16, verbose, message["wordCount"])
+    log("Found %s links", 14, verbose, len(domains) + 1)
+    log("Message URL: %s", 16, verbose, message["url"])
+    log("Timestamp: %s (hex: %s)", 16, verbose, message["timestamp"], message["hexTimestamp"])
+    log("Counting domains", 14, verbose)
+    log("Counting domains for %s links", 16, verbose, len(domains))
+    for link_index, domain in enumerate(domains):
+        log("Link %s: %s", 18, verbose, link_index, domain)
+    log("Found %s external references", 16, verbose, message["sourcesCount"])
+    log("Message %s successfully processed", 14, verbose, message["hexTimestamp"])
+
+
+def bench_logging(args):
+    months = load_months(args.input, args.start, args.limit)
+    if not months:
+        print("No saved months found for {}".format(args.input))
+        return
+
+    # the real messages and links, so the formatted values have their real size
+    samples = []
+    parse_time = None
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        results = [fefe.parseMonth(html, month, False) for month, html in months]
+        elapsed = time.perf_counter() - started
+        parse_time = elapsed if parse_time is None else min(parse_time, elapsed)
+    for result in results:
+        for hex_timestamp, message in result["messages"].items():
+            domains = [fefe.getDomain(url) for url in result["sourceLinks"].get(hex_timestamp, [])]
+            samples.append((message, domains))
+    if not samples:
+        print("No messages found")
+        return
+
+    print("Logging without --verbose, {} messages, best of {}:".format(len(samples), args.repeat))
+    parse_per_message = parse_time / len(samples)
+    timings = {}
+    for label, func in (("legacy", legacy_message_logs), ("lazy", lazy_message_logs)):
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            for index, (message, domains) in enumerate(samples):
+                func(index, len(samples), message, domains, False)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[label] = best
+        per_message = best / len(samples)
+        print("  {:<12} {:>8.2f} µs/message  {:>5.1f}% of parseMonth".format(label, per_message * 1e6, 100 * per_message / parse_per_message))
+    print("  parseMonth   {:>8.2f} µs/message".format(parse_per_message * 1e6))
+    print("  speedup: {:.2f}x".format(timings["legacy"] / timings["lazy"] if timings["lazy"] else 0))
+
+
+# markup the posts hardly have, but where a tree and a flat list of nodes could disagree
+EXTRACTOR_EDGE_CASES = [
+    '<a href="http://a.de">hier</a> <!-- comment --> <script>var a = "<a href=\'http://b.de\'>";</script> Text folgt. Mehr.',
+    '<a href="https://a.de/x">dies <b>ist</a> verschachtelt</b><blockquote>Ein Zitat <i>mit</i> genug Worten darin</blockquote>',
+    '<p><a href="http://a.de"><br></br>was das hier<img src=x></a><blockquote><![CDATA[CDATA, lang genug]]> x <style>b {}</style>mehr</blockquote>',
+    '<a href="http://a.de" href="?ts=1">doppeltes href</a><a href=https://b.de>zweiter Link mit langem Text</a>',
+    '<a href="http://a.de">dies</a><rt>Ruby</rt>&amp; &nosuch; &#x41;&#65x;&#xZZ; <br/> </br></br> Satzende! weiter',
+    '<!DOCTYPE html><?xml version="1.0"?><a href="https://www.google.de/maps/place">Maps</a><template>t</template> kurz <a href="http://c.de">c</a>.',
+    '<a href="http://a.de">hier<a href="http://b.de">ein Link im Link, lang genug</a></a><blockquote>offen',
+    '<div><a href="http://a.de">x</div></a> der Text danach geht noch eine ganze Weile weiter. Und mehr.',
+    '<a href="http://a.de">hier</a><rp>(</rp><rt>Ruby <a href="http://r.de">Link im Ruby-Text</a></rt> danach',
+    '<a href="http://a.de">hier</a> <script>nicht geschlossen <b>kein Tag',
+    # a blockquote and the end of a sentence on the last step of the next_element walks, and one step too far
+    *('<a href="http://a.de">Link</a>' + "<i>w</i>" * 9 + "<br>" * extra + "<blockquote>Ein Zitat, gerade lang genug</blockquote>"
+      for extra in (0, 1)),
+    *('<a href="http://a.de">hier</a>' + "<i>w</i>" * 29 + "<br>" * extra + "Ende." for extra in (0, 1)),
+    '<a href="  http://a.de ">hier',
+    '<table><tr><td><a href="http://a.de">dies</a></td><td>Text in der nächsten Zelle.</td></tr></table>',
+    '<a href="http://a.de">hier</a>\r\n Text mit \xa0 geschütztem Leerzeichen.',
+    '<a href="http://a.de">hier</a><textarea> x <b> y </textarea> z. <pre>   pre   </pre> a < b.',
+    '<a href="http://a.de">hier</a></p></p></div> &lt;b&gt; &#128512; &#0; &#x110000; &#55296; Ende.',
+    '<a href="http://a.de">hier</a><!bogus> <!-- nicht geschlossen',
+]
+
+# pieces of random markup for the parity check, see extractor_corpus
+EXTRACTOR_FRAGMENTS = [
+    '<a href="http://e.de/{}">', "</a>", "<blockquote>", "</blockquote>", "<b>", "</b>", "<br>", "</br>", "<br/>",
+    "<p>", "</p>", "</div>", "<i>", "<img>", "<!-- c -->", "<script>", "</script>", "<rt>", "</rt>",
+    '<a href="?ts=1">', "was das hier ", "dies ", "Satz. ", "&amp;", "ein paar Worte mehr ",
+]
+
+
+def extractor_corpus(args):
+    """(contentHtml, external title, external description) of the messages, the edge cases and generated markup."""
+    from message_store import iter_messages
+    from phase1_prepare_raw_data import pick_best_external
+
+    corpus = []
+    for _, message in iter_messages(args.input):
+        if args.limit and len(corpus) >= args.limit:
+            break
+        corpus.append((message.get("contentHtml", ""),) + pick_best_external(message.get("externalSources", [])))
+    posts = len(corpus)
+    corpus.extend((html, "", "") for html in EXTRACTOR_EDGE_CASES)
+    generator = random.Random(args.seed)
+    for _ in range(args.generated):
+        pieces = (generator.choice(EXTRACTOR_FRAGMENTS).format(generator.randint(0, 9)) for _ in range(generator.randint(1, 40)))
+        corpus.append(("".join(pieces), "", ""))
+    return corpus, posts
+
+
+def bench_extractor(args):
+    import phase1_prepare_raw_data as phase1
+
+    # bs4 warns about the <?xml ...?> of an edge case
+    warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
+    corpus, posts = extractor_corpus(args)
+    if not posts:
+        print("No messages found in {}".format(args.input))
+        return 1
+
+    results = {}
+    for extractor in phase1.EXTRACTORS:
+        phase1.configure_extractor(extractor)
+        results[extractor] = [phase1.build_topic_context_from_html(*inputs) for inputs in corpus]
+    mismatches = [(inputs[0], results["bs4"][i], results["stream"][i])
+                  for i, inputs in enumerate(corpus) if results["bs4"][i] != results["stream"][i]]
+    print("Parity, {} messages, {} edge cases, {} generated: {} mismatches".format(
+        posts, len(EXTRACTOR_EDGE_CASES), args.generated, len(mismatches)))
+    for html, expected, found in mismatches[:5]:
+        print("  {!r}\n    bs4:    {}\n    stream: {}".format(html[:200], expected, found))
+
+    print("Topic extraction, {} messages, best of {}:".format(posts, args.repeat))
+    timings = {}
+    for extractor in phase1.EXTRACTORS:
+        phase1.configure_extractor(extractor)
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            for inputs in corpus[:posts]:
+                phase1.build_topic_context_from_html(*inputs)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[extractor] = best
+        print("  {:<12} {:>8.3f}s  {:>10.1f} messages/s".format(extractor, best, posts / best if best else 0))
+    print("  speedup: {:.2f}x".format(timings["bs4"] / timings["stream"] if timings["stream"] else 0))
+    return 1 if mismatches else 0
+
+
+def words_document(terms, months):
+    """A words.json of fefe.py with `terms` words: one large 'sum' entry and a smaller entry per month."""
+    document = {"sum": {"wort{}".format(i): i % 1000 + 1 for i in range(terms)}}
+    for month in range(months):
+        document["2015{:02d}".format(month + 1)] = {"wort{}".format(i): i % 10 + 1 for i in range(month, terms, 7)}
+    return document
+
+
+def bench_json_reader(args):
+    from message_store import iter_json_object
+
+    def load():
+        with open(path, "r", encoding="utf8") as handle:
+            return json.load(handle)
+
+    path = args.input
+    if path is None:
+        handle, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(handle, "w", encoding="utf8") as output:
+            json.dump(words_document(args.terms, 12), output, ensure_ascii=False, indent=2)
+    try:
+        print("JSON reader, {} ({:.1f} MB), best of {}:".format(args.input or "generated words.json", os.path.getsize(path) / 1e6, args.repeat))
+        timings = {}
+        results = {}
+        for label, func in (("json.load", load),
+                            ("streamed", lambda: dict(iter_json_object(path)))):
+            best = None
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                results[label] = func()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[label] = best
+            print("  {:<12} {:>8.3f}s".format(label, best))
+    finally:
+        if args.input is None:
+            os.remove(path)
+    largest = max(results["json.load"].values(), key=lambda value: len(value) if isinstance(value, (dict, list)) else 0)
+    print("  largest entry: {} items".format(len(largest) if isinstance(largest, (dict, list)) else 1))
+    print("  streamed / json.load: {:.2f}x".format(timings["streamed"] / timings["json.load"] if timings["json.load"] else 0))
+    same = results["streamed"] == results["json.load"]
+    print("  identical entries: {}".format("yes" if same else "NO"))
+    return 0 if same else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for fefe.py on saved monthly pages and for phase1_prepare_raw_data.py")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    month_parser = subparsers.add_parser("month-parser", help="legacy month parsing vs. single-pass segmentMonth")
+    month_parser.set_defaults(func=bench_month_parser)
+
+    word_count = subparsers.add_parser("word-count", help="legacy per-word counting vs. Counter based countWords")
+    word_count.set_defaults(func=bench_word_count)
+
+    domains = subparsers.add_parser("domains", help="legacy getDomain vs. cached host normalization and registrable domains")
+    domains.set_defaults(func=bench_domains)
+
+    logging_overhead = subparsers.add_parser("logging", help="per-message cost of the log calls without --verbose, f-strings vs. lazy formatting")
+    logging_overhead.set_defaults(func=bench_logging)
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("--input", default="_data.html", help="file name template of saved months, as for fefe.py --input")
+        subparser.add_argument("--start", default="2005-03", help="first month, format is Y-m")
+        subparser.add_argument("--limit", type=int, default=12, help="number of months")
+        subparser.add_argument("--repeat", type=int, default=3, help="runs per variant, the best one counts")
+
+    # not on saved months, added after the common arguments
+    extractor = subparsers.add_parser("extractor", help="topic extraction of phase1, BeautifulSoup tree vs. flat event stream, "
+                                                        "including a check for identical topics")
+    extractor.add_argument("--input", default="messages.json", help="messages.json, messages.ndjson or messages.sqlite written by fefe.py")
+    extractor.add_argument("--limit", type=int, default=0, help="number of messages, 0 reads all")
+    extractor.add_argument("--generated", type=int, default=2000, help="documents of random markup added to the parity check")
+    extractor.add_argument("--seed", type=int, default=1, help="seed of the random markup")
+    extractor.add_argument("--repeat", type=int, default=3, help="runs per variant, the best one counts")
+    extractor.set_defaults(func=bench_extractor)
+
+    json_reader = subparsers.add_parser("json-reader", help="message_store.iter_json_object vs. json.load on a file with a large entry, "
+                                                            "including a check for identical entries")
+    json_reader.add_argument("--input", help="JSON object to read, e.g. words.json (default: a generated words.json)")
+    json_reader.add_argument("--terms", type=int, default=500000, help="words of the generated words.json (default: 500000)")
+    json_reader.add_argument("--repeat", type=int, default=3, help="runs per variant, the best one counts")
+    json_reader.set_defaults(func=bench_json_reader)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,111 @@
+"""
+Normalization of the hosts fefe links to, shared by the domain statistics of
+fefe.py and the link table of the SQLite store.
+
+A link is reduced to its host: lower case, without userinfo, port, trailing dot
+and a leading www./www2. label. Optionally the host is folded to its registrable
+domain (news.bbc.co.uk -> bbc.co.uk) with the rules of public_suffixes.txt, a
+local excerpt of the Public Suffix List in its original format, so the full list
+from https://publicsuffix.org/list/ can be dropped in as a replacement.
+Both steps are cached per host, as the same few thousand hosts come up again
+and again.
+"""
+
+import ipaddress
+import os
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+SUFFIX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "public_suffixes.txt")
+HOST_CACHE_SIZE = 65536
+
+# scheme and authority of an absolute (or protocol relative) url
+NETLOC_REGEX = re.compile(r"(?:[A-Za-z][A-Za-z0-9+.\-]*:)?//([^/?#]*)")
+WWW_REGEX = re.compile(r"^www\d*\.")
+
+_suffix_rules = None
+
+
+def load_suffix_rules(path=SUFFIX_FILE):
+    """
+    Read a file in Public Suffix List format. Returns (rules, wildcards, exceptions):
+    'co.uk', '*.ck' is stored as 'ck' in wildcards, '!www.ck' as 'www.ck' in exceptions.
+    """
+    rules, wildcards, exceptions = set(), set(), set()
+    with open(path, "r", encoding="utf8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line or line.startswith("//"):
+                continue
+            rule = line.split()[0].lower()
+            if rule.startswith("!"):
+                exceptions.add(rule[1:])
+            elif rule.startswith("*."):
+                wildcards.add(rule[2:])
+            else:
+                rules.add(rule)
+    return rules, wildcards, exceptions
+
+
+def netloc_of(href):
+    """The authority part of a link, 'user@Host:8080' of 'http://user@Host:8080/path'."""
+    match = NETLOC_REGEX.match(href)
+    if match:
+        return match.group(1)
+    # scheme-less links like 'heise.de/foo' or 'mailto:someone@example.org'
+    return href.split("/")[0]
+
+
+@lru_cache(maxsize=HOST_CACHE_SIZE)
+def normalize_host(netloc):
+    """Reduce an authority to its host: 'user@WWW.Heise.de:443' -> 'heise.de'."""
+    try:
+        host = urlsplit("//" + netloc).hostname or ""
+    except ValueError:
+        # e.g. an unbalanced '[' of an IPv6 address, fall back to plain string handling
+        host = netloc.rpartition("@")[2].split(":")[0].lower()
+    return WWW_REGEX.sub("", host.rstrip("."), count=1)
+
+
+def host_of(href):
+    """Normalized host a link points to, 'self' for fefe's references to his own posts."""
+    if href.startswith(("/?ts=", "?ts=")):
+        return "self"
+    return normalize_host(netloc_of(href))
+
+
+@lru_cache(maxsize=HOST_CACHE_SIZE)
+def registrable_domain(host):
+    """
+    Fold a normalized host to its registrable domain, the public suffix plus one label:
+    'news.bbc.co.uk' -> 'bbc.co.uk', 'foo.github.io' -> 'foo.github.io', 'a.b.heise.de' -> 'heise.de'.
+    IP addresses, 'self' and bare suffixes are returned unchanged.
+    """
+    global _suffix_rules
+    labels = host.split(".")
+    if len(labels) < 2:
+        return host
+    try:
+        ipaddress.ip_address(host)
+        return host
+    except ValueError:
+        pass
+
+    if _suffix_rules is None:
+        _suffix_rules = load_suffix_rules()
+    rules, wildcards, exceptions = _suffix_rules
+
+    # the longest matching rule wins, exceptions beat wildcards, unlisted TLDs are suffixes of their own
+    suffix_start = len(labels) - 1
+    for index in range(len(labels)):
+        candidate = ".".join(labels[index:])
+        if candidate in exceptions:
+            suffix_start = index + 1
+            break
+        if candidate in rules or (index + 1 < len(labels) and ".".join(labels[index + 1:]) in wildcards):
+            suffix_start = index
+            break
+    if suffix_start == 0:
+        return host
+    return ".".join(labels[suffix_start - 1:])
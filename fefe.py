@@ -1,6 +1,20 @@
 #!./.venv/bin/python3
 import urllib.request
+import urllib.parse
+import http.client
+from html.parser import HTMLParser
+from html import unescape
+import codecs
 import ssl
+import asyncio
+import threading
+import sqlite3
+import time
+import hashlib
+import logging
+import gzip
+import zlib
+import os
 from datetime import datetime
 from dateutil.relativedelta import *
 import argparse
@@ -9,55 +23,73 @@ import re # regular expresions
 import json # to convert python's dictionary to json
 import sys, getopt # to get parameters from command line
 import signal
+import atexit
 import select
 import termios
 import tty
-
-# Global flag for interrupt handling
-interrupt_requested = False
+from message_store import commit_atomic, open_atomic, write_file_atomic, write_json_object, write_ndjson, write_sqlite
+from domain_names import host_of, registrable_domain
+from message_index import MessageIndex
+from metrics import Metrics
+from http_client import HostUnavailable, HttpClient
+from collections import deque, Counter
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+
+# set on Ctrl+C, SIGTERM or ESC, the loops check it and stop after the current message, then the data is saved
+interruptRequested = threading.Event()
 
 def signal_handler(signum, frame):
-    """Handle Ctrl+C gracefully"""
-    global interrupt_requested
-    interrupt_requested = True
+    """Handle Ctrl+C and SIGTERM (e.g. from a process supervisor) gracefully"""
+    interruptRequested.set()
     print("\n\nInterrupt received! Finishing current message and saving data...")
 
-def check_for_escape():
-    """Check if ESC key was pressed (non-blocking)"""
-    global interrupt_requested
-    
-    # Simple fallback: just return if already interrupted
-    if interrupt_requested:
+class EscapeListener:
+    """
+    Watches stdin for ESC in a background thread and sets interruptRequested, so the loops
+    don't have to poll the terminal. The terminal is put into cbreak mode (keys arrive without
+    Enter, Ctrl+C still works) while listening. Does nothing if stdin is not a terminal
+    (cron, pipes, process supervisors), then only signals interrupt a run.
+    """
+
+    def __init__(self):
+        self.stopped = threading.Event()
+        self.thread = None
+        self.oldSettings = None
+
+    def start(self):
+        """
+        Start listening. Returns False if stdin is not a terminal.
+        """
+        if sys.platform not in ['darwin', 'linux', 'linux2'] or not sys.stdin.isatty():
+            return False
+        try:
+            self.fileno = sys.stdin.fileno()
+            self.oldSettings = termios.tcgetattr(self.fileno)
+            tty.setcbreak(self.fileno)
+        except (termios.error, OSError, ValueError):
+            self.oldSettings = None
+            return False
+        self.thread = threading.Thread(target=self.listen, name='escape-listener', daemon=True)
+        self.thread.start()
         return True
-    
-    # Only check on Unix-like systems (macOS, Linux)
-    if sys.platform not in ['darwin', 'linux', 'linux2']:
-        return False
-        
-    try:
-        # Check if input is available
-        if select.select([sys.stdin], [], [], 0) == ([sys.stdin], [], []):
-            # Save terminal settings
-            old_settings = termios.tcgetattr(sys.stdin)
-            try:
-                # Set terminal to raw mode
-                tty.setraw(sys.stdin.fileno())
-                # Read one character
-                char = sys.stdin.read(1)
-                # Check if it's ESC (ASCII 27)
-                if ord(char) == 27:
-                    interrupt_requested = True
+
+    def listen(self):
+        while not self.stopped.is_set() and not interruptRequested.is_set():
+            # wake up regularly, so stop() does not have to wait for a key
+            if select.select([self.fileno], [], [], 0.2)[0]:
+                if os.read(self.fileno, 1) == b'\x1b':
+                    interruptRequested.set()
                     print("\n\nESC pressed! Finishing current message and saving data...")
-                    return True
-            finally:
-                # Restore terminal settings
-                termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
-    except Exception as e:
-        # If there's any error with terminal handling, just continue silently
-        # This handles cases where terminal manipulation is not available
-        pass
-    
-    return False
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread != None:
+            self.thread.join()
+            self.thread = None
+        if self.oldSettings != None:
+            termios.tcsetattr(self.fileno, termios.TCSADRAIN, self.oldSettings)
+            self.oldSettings = None
 
 # thanks to https://www.netaction.de/datenvisualisierung-von-fefes-blogzeiten/ for figuring this out
 timestampKey    = 0xFEFEC0DE
@@ -65,170 +97,1080 @@ timestampKey    = 0xFEFEC0DE
 # fefe provides monthly overviews, containing all articles for one month, expected date-format is Ym (201505 for May, 2015)
 urlTemplate     = "https://blog.fefe.de/?mon="
 
+# messages are written to messages.json (one object), messages.ndjson (one message per line) or messages.sqlite (indexed store)
+messagesFormat  = 'json'
+# indentation of JSON output, None writes every entry on a single line
+jsonIndent      = 2
+# also write registrable_domains.json, the domain counts folded to registrable domains (news.bbc.co.uk -> bbc.co.uk)
+registrableDomains = False
+# SQLite file of the full-text index over the messages, updated with every write of the output files, None disables it
+messageIndexFile = None
+
+# timings and counters of this run, see metrics.py, the summary is written to metricsFile at the end (None disables it)
+metrics         = Metrics()
+metricsFile     = 'metrics.json'
+
+# version of the month parser, months parsed by an older version are parsed again instead of taking them from the scrape state
+parserVersion   = 3
+
 # prevent loop to run infinitely, for backup, script stops afert iMax iterations
 iMax            = 240
 
 # what chars to strip from words, before consider them
 ignoreChars     = '()[],;.:\!?"„\''
 # using regex for a more cleaner result, ignore the prior line, see description below
-ignoreCharsRegEx = '[\W\_]' # \W would not work, because _ is being ignored
+# everything but word characters and whitespace, \W alone would not work, because _ is being ignored
+ignoreCharsRegEx = re.compile(r'[^\w\s]|_')
+# fefe's sentences glued together by getText(), see countWords
+sentenceJoinRegEx = re.compile(r'(([\:\.\!\?1]+)([a-zA-Z1-9]+))')
 # for this word cloud, ignore words with less then minWordLength characters 
 minWordLength   = 4
 # heads up: as we also strip special chars (,.;) this will also ignore smilies... we dont count, how much Fefe uses smilies.
 
 
-def log(message, indent=0, verbose=False):
-    if not verbose:
-        return
-    if indent > 0:
-        print(' ' * indent, end='')
-    print(message)
+# debug output of --verbose, see log
+logger = logging.getLogger('fefe')
 
-def parseExternalSource(url, verbose):
+def configureLogging(verbose):
     """
-    Parse external URL to extract meta data like title, description, etc.
+    Print debug output to stdout as it is, one line per message, if verbose is set.
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG if verbose else logging.WARNING)
+
+def log(message, indent=0, verbose=False, *args):
+    """
+    Debug output, indented by indent spaces. The message is a %-format string for args, it is
+    only formatted when it is actually logged, so without verbose a call does no string work at all.
+    """
+    if verbose:
+        logger.debug('%*s' + message, indent, '', *args)
+
+# external pages are requested with a browser user agent, some sites refuse to answer otherwise
+sourceHeaders = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# the monthly pages are requested as what we are
+monthHeaders = {
+    'User-Agent': 'fefeScrape (https://github.com/nickyreinert/fefeScrape)',
+    'Accept-Encoding': 'gzip, deflate'
+}
+
+# all requests, to blog.fefe.de and to external sources, share one client, so rate limits, retries
+# and circuit breakers apply per host across all threads, see http_client.py (configured in __main__)
+httpClient = HttpClient(metrics=metrics, stop=interruptRequested)
+
+# if there is no </head> within this many bytes, we stop waiting for further <meta> tags
+sourceHeadMaxBytes = 262144
+# never read more than this from a single page, even if <h1> or <time> are still missing
+sourceMaxBytes = 2097152
+
+class MetaParser(HTMLParser):
+    """
+    Incremental tokenizer collecting the meta data that parseExternalSource is interested in:
+    <meta> tags, the first <title> and, only if they are needed, the first <h1> and <time>.
+    Usually everything is known after </head>, so the rest of the page never has to be loaded.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        # (attribute, value) -> content of the first matching meta tag, e.g. ('property', 'og:title')
+        self.meta = {}
+        self.texts = {}
+        self.capturing = {}
+        self.closed = set()
+        self.datetime = None
+        self.headClosed = False
+        self.bytesRead = 0
+
+    def feed(self, chunk):
+        """
+        Feed a chunk of bytes. Returns True as soon as all meta data is known.
+        """
+        self.bytesRead += len(chunk)
+        super().feed(self.decoder.decode(chunk))
+        if self.bytesRead >= sourceHeadMaxBytes:
+            self.headClosed = True
+        return self.isComplete()
+
+    def isComplete(self):
+        if not self.headClosed:
+            return False
+        if self.needsH1() and 'h1' not in self.closed:
+            return False
+        if self.needsTime() and self.datetime == None and 'time' not in self.closed:
+            return False
+        return True
+
+    def needsH1(self):
+        return not firstValue([self.meta.get(('property', 'og:title')), self.meta.get(('name', 'twitter:title')), self.getText('title')])
+
+    def needsTime(self):
+        return not firstValue([self.meta.get(('property', 'article:published_time')), self.meta.get(('name', 'date'))])
+
+    def getText(self, tag):
+        if tag in self.texts:
+            return ''.join(self.texts[tag])
+        return None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'meta':
+            for attribute in ('property', 'name'):
+                if attrs.get(attribute) != None:
+                    self.meta.setdefault((attribute, attrs[attribute]), attrs.get('content') or '')
+        elif tag == 'body':
+            self.headClosed = True
+        elif tag in ('title', 'h1', 'time') and tag not in self.texts:
+            if tag != 'title':
+                self.headClosed = True
+            if tag == 'time' and 'datetime' in attrs:
+                self.datetime = attrs['datetime'] or ''
+            self.texts[tag] = []
+            self.capturing[tag] = self.texts[tag]
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            self.headClosed = True
+        if self.capturing.pop(tag, None) != None:
+            self.closed.add(tag)
+
+    def handle_data(self, data):
+        for text in self.capturing.values():
+            text.append(data)
+
+def firstValue(candidates):
+    """
+    Return the first non-empty candidate, stripped. Like a chain of soup.find() calls, an empty
+    value of a present tag is kept if no later candidate has a value.
+    """
+    value = None
+    for candidate in candidates:
+        if candidate != None:
+            value = candidate.strip()
+            if value:
+                break
+    return value
+
+def extractMetadata(parser, url, verbose):
+    """
+    Extract meta data like title, description, etc. from a MetaParser fed with an external page.
     Returns a dictionary with extracted meta data.
     """
-    log(f"Parsing external source: {url}", 18, verbose)
-    
-    try:
-        # Create SSL context for potentially problematic certificates
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        
-        # Add headers to mimic a real browser
-        req = urllib.request.Request(url, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
-        
-        # Fetch the page with timeout
-        with urllib.request.urlopen(req, context=ssl_context, timeout=10) as response:
-            if response.getcode() != 200:
-                log(f"HTTP {response.getcode()} for {url}", 20, verbose)
-                return None
-                
-            html = response.read().decode('utf-8', errors='ignore')
-            
-        # Parse HTML to extract meta data
-        soup = BeautifulSoup(html, features="html.parser")
-        
-        metadata = {
-            'title': None,
-            'description': None,
-            'author': None,
-            'published': None,
-            'site_name': None,
-            'url': url
-        }
-        
+    meta = parser.meta
+
+    published = parser.datetime
+    if published == None:
+        published = parser.getText('time')
+
+    metadata = {
         # Try to get title from various sources
-        title_sources = [
-            soup.find('meta', {'property': 'og:title'}),
-            soup.find('meta', {'name': 'twitter:title'}),
-            soup.find('title'),
-            soup.find('h1')
-        ]
-        
-        for source in title_sources:
-            if source:
-                if source.name == 'meta':
-                    metadata['title'] = source.get('content', '').strip()
-                else:
-                    metadata['title'] = source.get_text().strip()
-                if metadata['title']:
-                    break
-        
+        'title': firstValue([meta.get(('property', 'og:title')), meta.get(('name', 'twitter:title')), parser.getText('title'), parser.getText('h1')]),
         # Try to get description
-        desc_sources = [
-            soup.find('meta', {'property': 'og:description'}),
-            soup.find('meta', {'name': 'twitter:description'}),
-            soup.find('meta', {'name': 'description'})
-        ]
-        
-        for source in desc_sources:
-            if source:
-                metadata['description'] = source.get('content', '').strip()
-                if metadata['description']:
-                    break
-        
+        'description': firstValue([meta.get(('property', 'og:description')), meta.get(('name', 'twitter:description')), meta.get(('name', 'description'))]),
         # Try to get author
-        author_sources = [
-            soup.find('meta', {'name': 'author'}),
-            soup.find('meta', {'property': 'article:author'}),
-            soup.find('meta', {'name': 'twitter:creator'})
-        ]
-        
-        for source in author_sources:
-            if source:
-                metadata['author'] = source.get('content', '').strip()
-                if metadata['author']:
-                    break
-        
+        'author': firstValue([meta.get(('name', 'author')), meta.get(('property', 'article:author')), meta.get(('name', 'twitter:creator'))]),
         # Try to get published date
-        date_sources = [
-            soup.find('meta', {'property': 'article:published_time'}),
-            soup.find('meta', {'name': 'date'}),
-            soup.find('time')
-        ]
-        
-        for source in date_sources:
-            if source:
-                if source.name == 'meta':
-                    metadata['published'] = source.get('content', '').strip()
-                else:
-                    metadata['published'] = source.get('datetime', source.get_text()).strip()
-                if metadata['published']:
-                    break
-        
+        'published': firstValue([meta.get(('property', 'article:published_time')), meta.get(('name', 'date')), published]),
         # Try to get site name
-        site_sources = [
-            soup.find('meta', {'property': 'og:site_name'}),
-            soup.find('meta', {'name': 'application-name'})
-        ]
-        
-        for source in site_sources:
-            if source:
-                metadata['site_name'] = source.get('content', '').strip()
-                if metadata['site_name']:
-                    break
-        
-        log(f"Extracted metadata: title='{metadata['title']}', site='{metadata['site_name']}'", 20, verbose)
-        return metadata
-        
+        'site_name': firstValue([meta.get(('property', 'og:site_name')), meta.get(('name', 'application-name'))]),
+        'url': url
+    }
+
+    log("Extracted metadata: title='%s', site='%s' from %s bytes", 20, verbose, metadata['title'], metadata['site_name'], parser.bytesRead)
+    return metadata
+
+def parseExternalSource(url, verbose):
+    """
+    Parse external URL to extract meta data like title, description, etc.
+    Returns a dictionary with extracted meta data, None if the source could not be parsed.
+    Raises HostUnavailable if the request was not sent because the host is given up.
+    """
+    log("Parsing external source: %s", 18, verbose, url)
+    
+    try:
+        # Stream the page with timeout, usually only until </head>
+        parser = MetaParser()
+        status, headers, body = httpClient.get(url, sourceHeaders, timeout=10, consumer=parser.feed, max_bytes=sourceMaxBytes)
+        if status != 200:
+            log("HTTP %s for %s", 20, verbose, status, url)
+            return None
+
+        return extractMetadata(parser, url, verbose)
+
+    except HostUnavailable:
+        raise
     except Exception as e:
-        log(f"Error parsing {url}: {str(e)}", 20, verbose)
+        log("Error parsing %s: %s", 20, verbose, url, e)
         return None
 
-def isMonthAlreadyProcessed(month, verbose):
+class SourceCache:
+    """
+    Persistent cache for meta data of external sources, keyed by url and stored in SQLite.
+    Failed fetches are cached as well (with a shorter ttl), so dead links are not retried
+    on every run. If the cache grows beyond maxEntries, least recently used entries are evicted.
+    """
+
+    def __init__(self, fileName, ttl=30 * 86400, negativeTtl=86400, maxEntries=200000, verbose=False):
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.maxEntries = maxEntries
+        self.verbose = verbose
+        self.stats = {'hits': 0, 'negativeHits': 0, 'misses': 0, 'expired': 0, 'stored': 0, 'evicted': 0}
+        self.connection = sqlite3.connect(fileName)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS sources ('
+            'url TEXT PRIMARY KEY, metadata TEXT, fetched REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS sources_accessed ON sources (accessed)')
+        self.connection.commit()
+        log("Opened source cache %s", 4, verbose, fileName)
+
+    def get(self, urls):
+        """
+        Look up urls in the cache. Returns a dictionary url -> meta data (None for cached failures),
+        urls that are not cached or expired are missing from the result.
+        """
+        now = time.time()
+        found = {}
+        for url in urls:
+            row = self.connection.execute('SELECT metadata, fetched FROM sources WHERE url = ?', (url,)).fetchone()
+            if row == None:
+                self.stats['misses'] += 1
+                continue
+            metadata, fetched = row
+            if now - fetched > (self.ttl if metadata != None else self.negativeTtl):
+                self.stats['expired'] += 1
+                continue
+            if metadata == None:
+                self.stats['negativeHits'] += 1
+                found[url] = None
+            else:
+                self.stats['hits'] += 1
+                found[url] = json.loads(metadata)
+        if found:
+            self.connection.executemany('UPDATE sources SET accessed = ? WHERE url = ?', [(now, url) for url in found])
+            self.connection.commit()
+        return found
+
+    def put(self, results):
+        """
+        Store a dictionary url -> meta data (None for failed fetches) and evict old entries.
+        """
+        now = time.time()
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO sources (url, metadata, fetched, accessed) VALUES (?, ?, ?, ?)',
+            [(url, None if metadata == None else json.dumps(metadata, ensure_ascii=False), now, now) for url, metadata in results.items()]
+        )
+        self.stats['stored'] += len(results)
+        self.evict()
+
+    def evict(self):
+        count = self.connection.execute('SELECT COUNT(*) FROM sources').fetchone()[0]
+        if count > self.maxEntries:
+            self.connection.execute(
+                'DELETE FROM sources WHERE url IN (SELECT url FROM sources ORDER BY accessed LIMIT ?)',
+                (count - self.maxEntries,)
+            )
+            self.stats['evicted'] += count - self.maxEntries
+            log("Evicted %s entries from source cache", 8, self.verbose, count - self.maxEntries)
+        self.connection.commit()
+
+    def close(self):
+        self.evict()
+        self.connection.close()
+        print('Source cache: {hits} hits, {negativeHits} cached failures, {misses} misses, {expired} expired, {stored} stored, {evicted} evicted'.format(**self.stats))
+
+class ExternalSourceFetcher:
+    """
+    Fetches meta data of external sources concurrently. Every url is fetched only once
+    per run, no matter how many posts link to it. The number of requests in flight is
+    limited globally and per host. With a SourceCache, urls known from former runs are not
+    fetched at all.
+    """
+
+    def __init__(self, concurrency=16, perHost=2, cache=None, verbose=False):
+        self.concurrency = concurrency
+        self.perHost = perHost
+        self.cache = cache
+        self.verbose = verbose
+        # url -> meta data, None if the source could not be parsed
+        self.metadata = {}
+        # urls of the current fetch that were not sent because their host is given up, see fetchOne
+        self.unavailable = set()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def fetch(self, urls):
+        """
+        Fetch all urls not seen so far in this run. Returns the meta data for the given urls.
+        """
+        newUrls = list(dict.fromkeys(url for url in urls if url not in self.metadata))
+        metrics.count('sourceLinks', len(urls))
+        if newUrls and self.cache != None:
+            cached = self.cache.get(newUrls)
+            self.metadata.update(cached)
+            newUrls = [url for url in newUrls if url not in cached]
+            metrics.count('sourceCacheHits', len(cached))
+        if newUrls:
+            metrics.count('sourcesFetched', len(newUrls))
+            log("Fetching %s new external sources (%s links)", 6, self.verbose, len(newUrls), len(urls))
+            asyncio.run(self.fetchAll(newUrls))
+            # sources cut short by an interrupt or never sent to a given up host are not cached as failures
+            if self.cache != None and not interruptRequested.is_set():
+                self.cache.put({url: self.metadata[url] for url in newUrls if url not in self.unavailable})
+        result = {url: self.metadata[url] for url in urls}
+        # later months and runs try them again, the host may be back by then
+        for url in self.unavailable:
+            del self.metadata[url]
+        self.unavailable = set()
+        return result
+
+    async def fetchAll(self, urls):
+        globalLimit = asyncio.Semaphore(self.concurrency)
+        hostLimits = {}
+        for url in urls:
+            host = urllib.parse.urlsplit(url).hostname
+            if host not in hostLimits:
+                hostLimits[host] = asyncio.Semaphore(self.perHost)
+        results = await asyncio.gather(*[
+            self.fetchOne(url, globalLimit, hostLimits[urllib.parse.urlsplit(url).hostname]) for url in urls
+        ])
+        for url, metadata in zip(urls, results):
+            self.metadata[url] = metadata
+
+    async def fetchOne(self, url, globalLimit, hostLimit):
+        loop = asyncio.get_running_loop()
+        async with hostLimit:
+            async with globalLimit:
+                try:
+                    return await loop.run_in_executor(self.executor, parseExternalSource, url, self.verbose)
+                except HostUnavailable as e:
+                    log("Skipped %s: %s", 20, self.verbose, url, e)
+                    metrics.count('sourcesUnavailable')
+                    self.unavailable.add(url)
+                    return None
+
+    def attach(self, result):
+        """
+        Fetch the external sources of all messages of a month (see parseMonth) and put
+        their meta data into message['externalSources'].
+        """
+        messages = result['messages']
+        urls = [url for hexTimestamp, links in result['sourceLinks'].items() if hexTimestamp in messages for url in links]
+        log("Parsing external sources for metadata", 6, self.verbose)
+        metadata = self.fetch(urls)
+        for hexTimestamp, links in result['sourceLinks'].items():
+            if hexTimestamp in messages:
+                messages[hexTimestamp]['externalSources'] = [metadata[url] for url in links if metadata[url]]
+                log("Parsed %s external sources for %s", 8, self.verbose, len(messages[hexTimestamp]['externalSources']), hexTimestamp)
+        result['sourcesParsed'] = True
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.cache != None:
+            self.cache.close()
+
+def loadScrapeState(stateDir, verbose):
+    """
+    Load the scrape state from stateDir. The manifest holds for every month when it was fetched,
+    the hash of its html and the ids of its messages, the parsed month itself is stored in {month}.json.
     """
-    Check if a month has already been processed by looking for existing HTML output file.
+    # validators (ETag, Last-Modified) of months fetched in this run, they go to the manifest with the month
+    # input is the --input template of the run, months read from local files are not skipped by the fetch time
+    state = {'dir': stateDir, 'manifest': {'months': {}}, 'reuse': True, 'validators': {}, 'input': None}
+    if stateDir == None:
+        return state
+
+    os.makedirs(stateDir, exist_ok=True)
+    manifestFileName = os.path.join(stateDir, 'manifest.json')
+    if os.path.exists(manifestFileName):
+        resFile = open(manifestFileName, 'r', encoding='utf8')
+        state['manifest'] = json.load(resFile)
+        resFile.close()
+    if state['manifest'].get('parserVersion', 1) != parserVersion:
+        # months parsed by an older parser have to be parsed again, their html is still in the archive
+        for entry in state['manifest']['months'].values():
+            entry['hash'] = None
+        state['manifest']['parserVersion'] = parserVersion
+    log("Loaded scrape state for %s months from %s", 4, verbose, len(state['manifest']['months']), stateDir)
+    return state
+
+def isMonthAlreadyProcessed(month, state, verbose, needsSources=False):
+    """
+    Check if a month is complete in the scrape state: it has been parsed, was fetched from blog.fefe.de
+    after the month ended and, if needsSources, its external sources were parsed as well.
     Returns True if the month should be skipped, False otherwise.
+    Months read from local files (--input) are never skipped, the file is read and getStoredMonth
+    reuses the stored messages if its hash did not change.
     """
-    import os
-    
-    # Check if HTML output file exists for this month
-    html_filename = f"{month}data.html"
-    if os.path.exists(html_filename):
-        log(f"Found existing HTML file for month {month}: {html_filename}", 6, verbose)
-        return True
+    if state['input'] != None:
+        return False
+    entry = state['manifest']['months'].get(month)
+    if entry == None or entry['hash'] == None or not os.path.exists(os.path.join(state['dir'], f"{month}.json")):
+        log("No scrape state found for month %s", 6, verbose, month)
+        return False
+
+    if entry.get('input') != None:
+        log("Month %s was read from local files, fetching it", 6, verbose, month)
+        return False
+
+    if needsSources and not entry.get('sourcesParsed', False):
+        log("Month %s was stored without its external sources", 6, verbose, month)
+        return False
+
+    # fefe may have posted after the last fetch, if that happened before the month was over
+    monthEnd = datetime.strptime(month, '%Y%m') + relativedelta(months=+1)
+    if datetime.fromisoformat(entry['fetched']) < monthEnd:
+        log("Month %s was fetched at %s, before it ended", 6, verbose, month, entry['fetched'])
+        return False
+
+    log("Found complete scrape state for month %s", 6, verbose, month)
+    return True
+
+def hasStoredSources(month, state):
+    """
+    Check if the external sources of a stored month were parsed.
+    """
+    return state['manifest']['months'].get(month, {}).get('sourcesParsed', False)
+
+def loadMonthState(month, state):
+    """
+    Load a month parsed in a former run, same format as the result of parseMonth.
+    """
+    resFile = open(os.path.join(state['dir'], f"{month}.json"), 'r', encoding='utf8')
+    result = json.load(resFile)
+    resFile.close()
+    return result
+
+def saveMonthState(month, result, state, verbose):
+    """
+    Store the result of parseMonth and update the manifest.
+    """
+    if state['dir'] == None:
+        return
+    write_file_atomic(os.path.join(state['dir'], f"{month}.json"), json.dumps(result, ensure_ascii=False))
+    previous = state['manifest']['months'].get(month, {})
+    validators = state['validators'].get(month, previous)
+    state['manifest']['months'][month] = {
+        'fetched'       : datetime.now().isoformat(timespec='seconds'),
+        'hash'          : result['hash'],
+        'messages'      : list(result['messages']),
+        'sourcesParsed' : result.get('sourcesParsed', False),
+        'input'         : state['input'],
+        'etag'          : validators.get('etag'),
+        'lastModified'  : validators.get('lastModified')
+    }
+    write_file_atomic(os.path.join(state['dir'], 'manifest.json'), json.dumps(state['manifest'], ensure_ascii=False, indent=2))
+    log("Saved scrape state for month %s", 6, verbose, month)
+
+def loadCheckpoint(state, verbose):
+    """
+    Load the progress of an unfinished run. Returns the list of months it has completed.
+    """
+    checkpointFileName = os.path.join(state['dir'], 'checkpoint.json')
+    if not os.path.exists(checkpointFileName):
+        print('No checkpoint found, starting from the beginning')
+        return []
+    resFile = open(checkpointFileName, 'r', encoding='utf8')
+    checkpoint = json.load(resFile)
+    resFile.close()
+    print('Resuming after {} months, last checkpoint at {}'.format(len(checkpoint['months']), checkpoint['updated']))
+    log("Resuming from checkpoint %s", 4, verbose, checkpointFileName)
+    return checkpoint['months']
+
+def saveCheckpoint(months, state):
+    """
+    Record the months completed by this run, so --resume can continue with the next one.
+    """
+    if state['dir'] == None:
+        return
+    write_file_atomic(os.path.join(state['dir'], 'checkpoint.json'), json.dumps({
+        'updated'   : datetime.now().isoformat(timespec='seconds'),
+        'months'    : months
+    }, ensure_ascii=False))
+
+def removeCheckpoint(state):
+    if state['dir'] != None and os.path.exists(os.path.join(state['dir'], 'checkpoint.json')):
+        os.remove(os.path.join(state['dir'], 'checkpoint.json'))
+
+def getMonths(startDateObj, endDateObj, iMax):
+    """
+    Build the ordered list of months (Ym strings) to process, limited to iMax entries.
+    """
+    months = []
+    while startDateObj <= endDateObj and len(months) < iMax:
+        months.append(startDateObj.strftime('%Y%m'))
+        startDateObj = startDateObj + relativedelta(months=+1)
+    return months
+
+def openMonthUrl(url, headers, verbose):
+    """
+    GET a page of blog.fefe.de, retrying without certificate verification if that fails.
+    Returns a tuple (status, headers, body).
+    """
+    try:
+        return httpClient.get(url, headers, timeout=30, verify=True)
+    except ssl.SSLCertVerificationError:
+        log("SSL certificate verification failed, retrying without verification", 8, verbose)
+        return httpClient.get(url, headers, timeout=30, verify=False)
+
+def decodeBody(body, contentEncoding):
+    """
+    Undo gzip or deflate content encoding of a response body.
+    """
+    contentEncoding = (contentEncoding or '').strip().lower()
+    if contentEncoding in ('gzip', 'x-gzip'):
+        return gzip.decompress(body)
+    if contentEncoding == 'deflate':
+        # some servers send a raw deflate stream instead of the zlib format
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+def fetchMonth(currentMonth, inputFile, state, verbose):
+    """
+    Get the raw html of one month, either from blog.fefe.de or from a local file.
+    Remote pages are archived in the scrape state, if the archived page is still up to date
+    (the server answers 304 to our ETag / Last-Modified), the archive is used instead.
+    """
+    with metrics.timer('fetch'):
+        return readMonth(currentMonth, inputFile, state, verbose)
+
+def readMonth(currentMonth, inputFile, state, verbose):
+    if inputFile == None:
+        url = urlTemplate + currentMonth
+        log("Fetching from URL: %s", 6, verbose, url)
+
+        headers = dict(monthHeaders)
+        archiveFileName = None
+        if state['dir'] != None:
+            archiveFileName = os.path.join(state['dir'], f"{currentMonth}.html")
+            entry = state['manifest']['months'].get(currentMonth, {})
+            if os.path.exists(archiveFileName):
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('lastModified'):
+                    headers['If-Modified-Since'] = entry['lastModified']
+
+        status, responseHeaders, body = openMonthUrl(url, headers, verbose)
+        if status == 304:
+            log("Month %s not modified, reading archived html", 8, verbose, currentMonth)
+            metrics.count('monthsNotModified')
+            resInputFile = open(archiveFileName, 'r', encoding='utf8')
+            html = resInputFile.read()
+            resInputFile.close()
+            return html
+        if status != 200:
+            raise urllib.error.HTTPError(url, status, http.client.responses.get(status, ''), responseHeaders, None)
+
+        metrics.count('bytesFetched', len(body))
+        html = decodeBody(body, responseHeaders.get('Content-Encoding'))
+        html = html.decode('utf8')
+        validators = {
+            'etag'          : responseHeaders.get('ETag'),
+            'lastModified'  : responseHeaders.get('Last-Modified')
+        }
+        log("Successfully fetched %s characters", 8, verbose, len(html))
+
+        if archiveFileName != None:
+            write_file_atomic(archiveFileName, html)
+            state['validators'][currentMonth] = validators
+    else:
+        inputFileName = '{}{}'.format(currentMonth, inputFile)
+        log("Reading from local file: %s", 6, verbose, inputFileName)
+        resInputFile = open(inputFileName, 'r', encoding='utf8')
+        html = resInputFile.read()
+        resInputFile.close()
+        metrics.count('bytesRead', len(html))
+        log("Successfully read %s characters from file", 8, verbose, len(html))
+
+    return html
+
+def fetchMonths(months, inputFile, workers, state, verbose):
+    """
+    Yield (month, html) tuples in the given order. With more than one worker, the
+    pages are fetched concurrently by a thread pool, but still handed out in order,
+    so the parsing path sees exactly the same sequence as a sequential run.
+    """
+    if workers <= 1:
+        for currentMonth in months:
+            try:
+                html = fetchMonth(currentMonth, inputFile, state, verbose)
+            except urllib.error.URLError:
+                # an interrupt ends the waits between retries, that is not an error of the month
+                if interruptRequested.is_set():
+                    return
+                raise
+            yield currentMonth, html
+        return
+
+    log("Fetching %s months with %s workers", 4, verbose, len(months), workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        # keep at most 2 * workers pages in flight, so we don't hold the whole archive in memory
+        pending = deque()
+        monthIterator = iter(months)
+        for currentMonth in monthIterator:
+            pending.append((currentMonth, executor.submit(fetchMonth, currentMonth, inputFile, state, verbose)))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            currentMonth, future = pending.popleft()
+            try:
+                html = future.result()
+            except urllib.error.URLError:
+                if interruptRequested.is_set():
+                    return
+                raise
+            nextMonth = next(monthIterator, None)
+            if nextMonth != None:
+                pending.append((nextMonth, executor.submit(fetchMonth, nextMonth, inputFile, state, verbose)))
+            yield currentMonth, html
+    finally:
+        # don't wait for pages we will never parse (e.g. after an interrupt)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# tags that matter for cutting a month into messages, comments are matched so that tags inside them are skipped
+segmentTagRegEx = re.compile(r'<!--.*?-->|<(/?)(ul|li|h3)\b[^>]*>', re.IGNORECASE | re.DOTALL)
+
+def segmentMonth(html):
+    """
+    Cut the html of one month into messages in a single pass. fefe does not close his <li>-tags,
+    so a message is everything from one <li> of a top level <ul> to the next one (or the end of the <ul>).
+    Lists nested in a message stay part of that message.
+    Returns a list of (day, [liHtml, ...]) tuples, one per <ul>, day is taken from the preceding <h3>.
+    """
+    days = []
+    currentDay = "unknown"
+    h3Start = None
+    depth = 0
+    liStart = None
+    fragments = []
+
+    for match in segmentTagRegEx.finditer(html):
+        tagName = match.group(2)
+        if tagName == None:
+            continue
+        tagName = tagName.lower()
+        closing = match.group(1) == '/'
+
+        if tagName == 'h3':
+            if not closing:
+                h3Start = match.end()
+            elif h3Start != None:
+                currentDay = unescape(re.sub(r'<[^>]*>', '', html[h3Start:match.start()])).strip()
+                h3Start = None
+
+        elif tagName == 'ul':
+            if not closing:
+                depth += 1
+                if depth == 1:
+                    fragments = []
+                    liStart = None
+            elif depth > 0:
+                depth -= 1
+                if depth == 0:
+                    if liStart != None:
+                        fragments.append(html[liStart:match.start()] + '</li>')
+                    days.append((currentDay, fragments))
+
+        elif tagName == 'li' and not closing and depth == 1:
+            if liStart != None:
+                fragments.append(html[liStart:match.start()] + '</li>')
+            liStart = match.start()
+
+    # a last <ul> that is never closed still counts
+    if depth > 0:
+        if liStart != None:
+            fragments.append(html[liStart:] + '</li>')
+        days.append((currentDay, fragments))
+
+    return days
+
+def parseMonth(html, currentMonth, verbose):
+    """
+    Parse the html of one month. Returns a dictionary with the messages, words and
+    domains found in this month, the external source urls per message, the number
+    of invalid <a>-tags fixed on the way and the seconds spent per stage.
+    """
+    invalidATags = 0
+    processedMessages = 0
+    htmlHash = hashlib.sha256(html.encode('utf8')).hexdigest()
+
+    messages = {}
+    sourceLinks = {}
+    wordsUsed = {currentMonth: Counter()}
+    domainsUsed = {currentMonth: Counter()}
+    # seconds per stage, returned with the result, as this may run in a worker process
+    timings = Counter()
+    started = time.perf_counter()
+
+    # thats our function to sanitize incoming html, see above comment: if fefe does not close the <a>-tag, our parser
+    # tries to close it, but this will affect following list elements, so we try to fix it ourself
+    htmlLines = html.splitlines()
+    cleanHtmlLines = []
     
-    log(f"No existing HTML file found for month {month}", 6, verbose)
-    return False
+    log("Sanitizing HTML for unclosed <a> tags", 6, verbose)
+    for line in htmlLines:
+        cleanLine = line
+        if cleanLine.count('<a') != cleanLine.count('</a>'):
+            invalidATags += 1
+            log("Found unclosed <a> tag in line, fixing...", 8, verbose)
+            while cleanLine.count('<a') > cleanLine.count('</a>'):
+                cleanLine += '</a>'
+        cleanHtmlLines.append(cleanLine)
+
+    html = ''.join(cleanHtmlLines)
+    log("HTML sanitization complete. Found %s invalid tags in this month", 6, verbose, invalidATags)
+    timings['sanitize'] = time.perf_counter() - started
+    started = time.perf_counter()
+
+    # since fefe does not provide closing end tag for <li>, we don't build a tree of the whole month,
+    # instead segmentMonth cuts the html into messages in a single pass and each message is parsed on its own
+    log("Segmenting HTML into messages", 6, verbose)
+    days = segmentMonth(html)
+    log("Found %s unordered lists", 6, verbose, len(days))
+    timings['segment'] = time.perf_counter() - started
+    started = time.perf_counter()
+                
+    for listIndex, (currentDay, liFragments) in enumerate(days):
+        # Check for interrupt at the beginning of each day's processing
+        if interruptRequested.is_set():
+            print(f"\nInterrupt detected during day processing. Breaking out of day loop...")
+            break
+            
+        log("Processing unordered list %s/%s", 8, verbose, listIndex + 1, len(days))
+        
+        rawMessages = []
+        for liHtml in liFragments:
+            liElement = BeautifulSoup(liHtml, features="html.parser").find('li')
+            if liElement:
+                rawMessages.append(liElement)
+        
+        log("Found %s messages after manual parsing", 10, verbose, len(rawMessages))
+
+        # Count total messages with ts parameter for progress tracking
+        totalMessages = 0
+        for msg in rawMessages:
+            links = msg.find_all('a')
+            for link in links:
+                if link.has_attr('href') and '?ts=' in link['href']:
+                    totalMessages += 1
+                    break
+
+        print(f"Found {totalMessages} messages to process for {currentDay}")
+        processedMessages = 0
+
+        for messageIndex, rawMessage in enumerate(rawMessages):
+            # Check for interrupt (Ctrl+C, SIGTERM or ESC, see EscapeListener) during message processing
+            if interruptRequested.is_set():
+                print(f"\nInterrupt detected during message processing. Breaking out of message loop...")
+                break
+            
+            log("Processing message %s/%s", 12, verbose, messageIndex + 1, len(rawMessages))
 
-def getMessages(startDate, inputFile, outputFile, iMax, verbose, parseSource, force):
+            try:
+                message = {
+                    'timestamp'     : None,
+                    'hexTimestamp'  : None,
+                    'quoteCount'    : 0,
+                    'wordCount'     : 0,
+                    'sourcesCount'  : 0,
+                    'url'           : None, # this is more for examination purposes: providing the url to check the results
+                    'content'       : None, # the actual message content
+                    'contentHtml'   : None, # the raw HTML content
+                    'externalSources': []   # metadata from external sources
+                }
+                
+                # Store the raw HTML content
+                message['contentHtml'] = str(rawMessage)
+                log("Stored raw HTML content", 14, verbose)
+                
+                log("Cleaning up quotes", 14, verbose)
+                cleanMessage = cleanUpQuotes(rawMessage)
+                message['quoteCount'] = cleanMessage['count']                
+                cleanMessage = cleanMessage['text']
+                log("Found %s quotes", 16, verbose, message['quoteCount'])
+
+                # Store the cleaned text content (without HTML tags)
+                text = cleanMessage.get_text()
+                message['content'] = text.strip()
+                log("Stored cleaned text content", 14, verbose)
+
+                # we add current month to the countWords function, this way we can analyse if used words are changing over the time,
+                # same for countDomains, couple of lines later
+                log("Counting words", 14, verbose)
+                stageStarted = time.perf_counter()
+                message['wordCount'] = countWords(text, currentMonth, wordsUsed, verbose)
+                timings['countWords'] += time.perf_counter() - stageStarted
+                log("Found %s words", 16, verbose, message['wordCount'])
+
+                links = cleanMessage.find_all('a')
+                log("Found %s links", 14, verbose, len(links))
+                
+                if len(links) == 0:
+                    log("ERROR: No links found in message, skipping", 14, verbose)
+                    continue
+
+                message['url'] = 'https://blog.fefe.de/' + links[0]['href']
+                log("Message URL: %s", 16, verbose, message['url'])
+
+                # first get fefes secred timestamp                
+                timestamp_match = re.search('\?ts\=(.*)', links[0]['href'])
+                if not timestamp_match:
+                    log("ERROR: No timestamp found in first link, skipping", 14, verbose)
+                    continue
+                    
+                hexTimestamp = timestamp_match.group(1)
+                message['hexTimestamp'] = hexTimestamp
+                timestamp = getTimestamp(hexTimestamp)            
+                message['timestamp'] = timestamp
+                log("Timestamp: %s (hex: %s)", 16, verbose, timestamp, hexTimestamp)
+
+                # then remove this first link, and get other references from this messages
+                links.pop(0)
+                log("Counting domains", 14, verbose)
+                stageStarted = time.perf_counter()
+                message['sourcesCount'] = countDomains(links, currentMonth, domainsUsed, verbose)
+                timings['countDomains'] += time.perf_counter() - stageStarted
+                log("Found %s external references", 16, verbose, message['sourcesCount'])
+                
+                if message['timestamp'] == None:
+                    log("WARNING: Message has no timestamp, skipping", 14, verbose)
+                    continue
+
+                if message['hexTimestamp'] in messages:
+                    log("WARNING: Message with id %s already exists, skipping", 14, verbose, message['hexTimestamp'])
+                    continue
+
+                messages[message['hexTimestamp']] = message
+                # remember external sources, their meta data is fetched for the whole month at once, see ExternalSourceFetcher
+                sourceLinks[message['hexTimestamp']] = getExternalSourceUrls(links)
+                processedMessages += 1
+                print(f"Processing {currentDay}: {processedMessages}/{totalMessages} messages", end='\r')
+                log("Message %s successfully processed", 14, verbose, message['hexTimestamp'])
+                
+            except Exception as e:
+                log("ERROR processing message %s: %s", 12, verbose, messageIndex + 1, e)
+                if verbose:
+                    import traceback
+                    traceback.print_exc()
+                continue
+
+    # parsing is everything after the segmentation, except counting words and domains
+    timings['parse'] = time.perf_counter() - started - timings['countWords'] - timings['countDomains']
+
+    return {
+        'messages'          : messages,
+        'sourceLinks'       : sourceLinks,
+        'wordsUsed'         : wordsUsed[currentMonth],
+        'domainsUsed'       : domainsUsed[currentMonth],
+        'invalidATags'      : invalidATags,
+        'processedMessages' : processedMessages,
+        'hash'              : htmlHash,
+        'sourcesParsed'     : False,
+        'timings'           : timings
+    }
+
+class TermCounts:
+    """
+    Word (or domain) counts per month with an interned vocabulary: every term is stored once and
+    gets an id, a month is just two compact arrays of term ids and counts, in the order the terms
+    first appeared in that month. Ids are handed out in order of first appearance over all months,
+    so the sum is a plain array indexed by id. Exports the same nested dictionaries as before,
+    {'sum': {term: count}, month: {term: count}}, one month at a time.
+    The series of a term (see getSeries) come from an index of the months and counts per term,
+    built on the first query, so runs that don't need it don't hold it.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.terms = []
+        self.months = {}
+        self.total = array('Q')
+        # (months, month positions per term id, counts per term id), see buildSeriesIndex
+        self.seriesIndex = None
+
+    def add(self, month, counts):
+        """
+        Add the counts of a month (term -> count, e.g. a Counter), months have to be added in chronological order.
+        """
+        monthIds = array('I')
+        monthCounts = array('I')
+        for term, count in counts.items():
+            termId = self.ids.get(term)
+            if termId == None:
+                termId = len(self.terms)
+                # the vocabulary and the id lookup share one string
+                term = sys.intern(term)
+                self.ids[term] = termId
+                self.terms.append(term)
+                self.total.append(0)
+            monthIds.append(termId)
+            monthCounts.append(count)
+            self.total[termId] += count
+        self.months[month] = (monthIds, monthCounts)
+        self.seriesIndex = None
+
+    def getMonth(self, month):
+        monthIds, monthCounts = self.months[month]
+        terms = self.terms
+        return {terms[termId]: count for termId, count in zip(monthIds, monthCounts)}
+
+    def getSum(self):
+        return dict(zip(self.terms, self.total))
+
+    def buildSeriesIndex(self):
+        """
+        Invert the months: for every term id the positions of the months it appears in and its counts there.
+        """
+        months = list(self.months)
+        positions = [array('H') for _ in self.terms]
+        counts = [array('I') for _ in self.terms]
+        for position, (monthIds, monthCounts) in enumerate(self.months.values()):
+            for termId, count in zip(monthIds, monthCounts):
+                positions[termId].append(position)
+                counts[termId].append(count)
+        self.seriesIndex = (months, positions, counts)
+
+    def getSeries(self, term):
+        """
+        Counts of a term per month, 0 for months without it. Only the months of the term are looked at.
+        """
+        series = dict.fromkeys(self.months, 0)
+        termId = self.ids.get(term)
+        if termId == None:
+            return series
+        if self.seriesIndex == None:
+            self.buildSeriesIndex()
+        months, positions, counts = self.seriesIndex
+        for position, count in zip(positions[termId], counts[termId]):
+            series[months[position]] = count
+        return series
+
+    def items(self):
+        """
+        Yield ('sum', {term: count}) and (month, {term: count}) for every month, like dict.items().
+        """
+        yield 'sum', self.getSum()
+        for month in self.months:
+            yield month, self.getMonth(month)
+
+def initParseWorker(verbose):
+    """
+    Set up a process of the parsing pool: the parent takes care of Ctrl+C and ESC.
+    """
+    configureLogging(verbose)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def getStoredMonth(currentMonth, html, state, verbose):
+    """
+    Return the stored result of a month, if its html did not change since it was parsed, None otherwise.
+    """
+    if not state['reuse']:
+        return None
+    entry = state['manifest']['months'].get(currentMonth)
+    if entry == None or entry['hash'] != hashlib.sha256(html.encode('utf8')).hexdigest():
+        return None
+    if not os.path.exists(os.path.join(state['dir'], f"{currentMonth}.json")):
+        return None
+    log("Month %s did not change, reusing stored messages", 6, verbose, currentMonth)
+    result = loadMonthState(currentMonth, state)
+    result.pop('timings', None)
+    return result
+
+def parseMonths(fetchedMonths, outputFile, jobs, state, verbose):
+    """
+    Save and parse the months yielded by fetchMonths, yield (month, result) tuples in the same order.
+    Months with the same html as in the scrape state are not parsed again.
+    With more than one job, months are parsed by a pool of processes, which only return the
+    compact result of parseMonth (see there) to be merged by the parent.
+    """
+    if jobs <= 1:
+        for currentMonth, html in fetchedMonths:
+            putRawHtmlToDisk(html, currentMonth, outputFile, verbose)
+            result = getStoredMonth(currentMonth, html, state, verbose)
+            if result == None:
+                result = parseMonth(html, currentMonth, verbose)
+            yield currentMonth, collectTimings(result)
+        return
+
+    log("Parsing months with %s processes", 4, verbose, jobs)
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=initParseWorker, initargs=(verbose,))
+    try:
+        # keep at most 2 * jobs months in the pool, so results are merged while the others are parsed
+        pending = deque()
+        for currentMonth, html in fetchedMonths:
+            putRawHtmlToDisk(html, currentMonth, outputFile, verbose)
+            result = getStoredMonth(currentMonth, html, state, verbose)
+            if result != None:
+                future = Future()
+                future.set_result(result)
+            else:
+                future = executor.submit(parseMonth, html, currentMonth, verbose)
+            pending.append((currentMonth, future))
+            if len(pending) >= 2 * jobs:
+                currentMonth, future = pending.popleft()
+                yield currentMonth, collectTimings(future.result())
+        while pending:
+            currentMonth, future = pending.popleft()
+            yield currentMonth, collectTimings(future.result())
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def collectTimings(result):
+    """
+    Move the stage timings of a parsed month into the metrics of this run, they are not part of the scrape state.
+    A month taken from the scrape state has none.
+    """
+    timings = result.pop('timings', None)
+    if timings == None:
+        metrics.count('monthsUnchanged')
+    else:
+        metrics.add_timings(timings)
+        metrics.count('monthsParsed')
+        metrics.count('messagesParsed', len(result['messages']))
+    return result
+
+def mergeMonth(result, currentMonth, messages, wordsUsed, domainsUsed, linksUsed, verbose):
+    """
+    Fold the result of parseMonth into the global data structures. Months have to be
+    merged in chronological order, this keeps the output identical to a sequential run.
+    """
+    for hexTimestamp, message in result['messages'].items():
+        if hexTimestamp in messages:
+            log("WARNING: Message with id %s already exists, skipping", 6, verbose, hexTimestamp)
+            continue
+        messages[hexTimestamp] = message
+        linksUsed[hexTimestamp] = result['sourceLinks'].get(hexTimestamp, [])
+    metrics.count('months')
+    metrics.count('messages', len(result['messages']))
+
+    # the sums are derived from the months, see TermCounts
+    wordsUsed.add(currentMonth, result['wordsUsed'])
+    domainsUsed.add(currentMonth, result['domainsUsed'])
+
+def getMessages(startDate, inputFile, outputFile, iMax, verbose, sourceFetcher, force, workers=1, jobs=1, stateDir=None, checkpointEvery=12, resume=False):
 
     log("Starting message parsing", 0, verbose)
     
     # Initialize local variables instead of using globals
     i = 0
     invalidATags = 0
-    progress = 0 
     
     # Initialize data structures
     messages = {}
-    wordsUsed = {}
-    domainsUsed = {}
+    wordsUsed = TermCounts()
+    domainsUsed = TermCounts()
+    # external urls per message, for the link table of the SQLite store
+    linksUsed = {}
     
     log("Initialized data structures", 2, verbose)
     
@@ -237,311 +1179,132 @@ def getMessages(startDate, inputFile, outputFile, iMax, verbose, parseSource, fo
 
     print ('\r\nParsing...')
 
-    domainsUsed['sum'] = {}
-    wordsUsed['sum'] = {}
+    state = loadScrapeState(stateDir, verbose)
+    # with --force every month is fetched and parsed again
+    state['reuse'] = not force
+    state['input'] = inputFile
+
+    # months completed by this run, resumed months count as well
+    completedMonths = []
+    if resume:
+        completedMonths = loadCheckpoint(state, verbose)
+
+    # months to fetch, and months complete in the scrape state, which are merged from there
+    months = []
+    storedMonths = deque()
+    needsSources = sourceFetcher != None
+    for currentMonth in getMonths(startDateObj, endDateObj, iMax):
+        # Check if this month has already been processed, a month stored without sources is not complete with --parse-source
+        resumed = currentMonth in completedMonths and (not needsSources or hasStoredSources(currentMonth, state))
+        if resumed or (not force and isMonthAlreadyProcessed(currentMonth, state, verbose, needsSources)):
+            print(f"Month {currentMonth} already processed, reusing stored messages")
+            log("Month %s already processed, skipping", 4, verbose, currentMonth)
+            storedMonths.append(currentMonth)
+            continue
+        months.append(currentMonth)
+    # counted now, the loop below takes the stored months off the queue
+    storedCount = len(storedMonths)
 
-    log(f"Starting main processing loop for {pagesToQuery} pages", 2, verbose)
+    log("Starting main processing loop for %s of %s pages", 2, verbose, len(months), pagesToQuery)
 
-    # Set up signal handler for Ctrl+C
+    # Set up signal handlers for Ctrl+C and process supervisors, and the ESC listener if we run in a terminal
     signal.signal(signal.SIGINT, signal_handler)
-    print("Press ESC or Ctrl+C to interrupt and save data safely...")
+    signal.signal(signal.SIGTERM, signal_handler)
+    escapeListener = EscapeListener()
+    # the terminal settings are restored even if the run crashes
+    atexit.register(escapeListener.stop)
+    if escapeListener.start():
+        print("Press ESC or Ctrl+C to interrupt and save data safely...")
+    else:
+        print("Press Ctrl+C (or send SIGTERM) to interrupt and save data safely...")
 
-    while startDateObj <= endDateObj:
+    fetchedMonths = fetchMonths(months, inputFile, workers, state, verbose)
+    for currentMonth, result in parseMonths(fetchedMonths, outputFile, jobs, state, verbose):
 
         # Check for interrupt at the beginning of each month
-        if interrupt_requested:
-            print(f"\nInterrupt detected. Saving data and exiting...")
-            break
-            
-        # Check for ESC key press (non-blocking)
-        check_for_escape()
-        if interrupt_requested:
+        if interruptRequested.is_set():
             print(f"\nInterrupt detected. Saving data and exiting...")
             break
 
-        currentMonth = startDateObj.strftime('%Y%m')
-        currentUrl = urlTemplate + currentMonth
-        print(f"Processing month: {currentMonth} - {currentUrl}")
-        log(f"Processing month: {currentMonth}", 4, verbose)
-
-        # Check if this month has already been processed
-        if not force and isMonthAlreadyProcessed(currentMonth, verbose):
-            print(f"Month {currentMonth} already processed, skipping")
-            log(f"Month {currentMonth} already processed, skipping", 4, verbose)
-            startDateObj = startDateObj + relativedelta(months=+1)
-            i += 1
-            continue
-
-        domainsUsed[currentMonth] = {}
-        wordsUsed[currentMonth] = {}
+        print(f"Processing month: {currentMonth} - {urlTemplate + currentMonth}")
+        log("Processing month: %s", 4, verbose, currentMonth)
 
-        showProgress(i, pagesToQuery)
-        if inputFile == None:
-            url = urlTemplate + currentMonth
-            log(f"Fetching from URL: {url}", 6, verbose)
-            try:
-                html = urllib.request.urlopen(url).read()
-                html = html.decode('utf8')
-                log(f"Successfully fetched {len(html)} characters", 8, verbose)
-            except urllib.error.URLError as e:
-                if 'CERTIFICATE_VERIFY_FAILED' in str(e):
-                    log("SSL certificate verification failed, retrying without verification", 8, verbose)
-                    # Create an SSL context that doesn't verify certificates
-                    ssl_context = ssl.create_default_context()
-                    ssl_context.check_hostname = False
-                    ssl_context.verify_mode = ssl.CERT_NONE
-                    html = urllib.request.urlopen(url, context=ssl_context).read()
-                    html = html.decode('utf8')
-                    log(f"Successfully fetched {len(html)} characters without SSL verification", 8, verbose)
-                else:
-                    raise
-        else:
-            inputFileName = '{}{}'.format(currentMonth, inputFile)
-            log(f"Reading from local file: {inputFileName}", 6, verbose)
-            resInputFile = open(inputFileName, 'r', encoding='utf8')
-            html = resInputFile.read()
-            resInputFile.close()
-            log(f"Successfully read {len(html)} characters from file", 8, verbose)
+        showProgress(i, max(pagesToQuery, 1))
 
-        putRawHtmlToDisk(html, currentMonth, outputFile, verbose)
+        # months from the scrape state that come before this one, so the output stays in chronological order
+        while storedMonths and storedMonths[0] < currentMonth:
+            storedMonth = storedMonths.popleft()
+            mergeMonth(loadMonthState(storedMonth, state), storedMonth, messages, wordsUsed, domainsUsed, linksUsed, verbose)
+            metrics.count('monthsFromState')
 
-        # thats our function to sanitize incoming html, see above comment: if fefe does not close the <a>-tag, our parser
-        # tries to close it, but this will affect following list elements, so we try to fix it ourself
-        htmlLines = html.splitlines()
-        cleanHtmlLines = []
-        
-        log("Sanitizing HTML for unclosed <a> tags", 6, verbose)
-        for line in htmlLines:
-            cleanLine = line
-            if cleanLine.count('<a') != cleanLine.count('</a>'):
-                invalidATags += 1
-                log(f"Found unclosed <a> tag in line, fixing...", 8, verbose)
-                while cleanLine.count('<a') > cleanLine.count('</a>'):
-                    cleanLine += '</a>'
-            cleanHtmlLines.append(cleanLine)
-
-        html = ''.join(cleanHtmlLines)
-        log(f"HTML sanitization complete. Found {invalidATags} invalid tags so far", 6, verbose)
-
-        # since fefe does not provide closing end tag for <li>, we need to use lxml parser
-        # if you want to use html.parser, make sure to define selfClosingTags=["li"]
-        # We'll use a different approach to handle the unclosed <li> tags
-        log("Parsing HTML with BeautifulSoup", 6, verbose)
-        htmlObj = BeautifulSoup(html, features="html.parser")
-        
-        # Debug: Let's see what the parsed HTML structure looks like
-        log(f"HTML structure debug - looking for <ul> tags", 6, verbose)
-        allUlTags = htmlObj.find_all('ul')
-        log(f"Found {len(allUlTags)} <ul> tags total (recursive=True)", 6, verbose)
-        
-        # loop through every message and get some date
-        unorderedLists = htmlObj.find_all('ul', recursive=False)
-        log(f"Found {len(unorderedLists)} unordered lists (recursive=False)", 6, verbose)
-        
-        # If we don't find any with recursive=False, let's try with recursive=True
-        if len(unorderedLists) == 0:
-            log("No <ul> found with recursive=False, trying recursive=True", 6, verbose)
-            unorderedLists = htmlObj.find_all('ul', recursive=True)
-            log(f"Found {len(unorderedLists)} unordered lists (recursive=True)", 6, verbose)
-            
-            # Let's also check the HTML structure
-            if verbose:
-                log("HTML structure around <ul>:", 8, verbose)
-                for i, ul in enumerate(unorderedLists):
-                    log(f"UL {i}: parent = {ul.parent.name if ul.parent else 'None'}", 10, verbose)
-                    lis = ul.find_all('li', recursive=False)
-                    log(f"  Contains {len(lis)} <li> elements", 10, verbose)
-                    
-        for listIndex, unorderedList in enumerate(unorderedLists):
-            # Check for interrupt at the beginning of each day's processing
-            if interrupt_requested:
-                print(f"\nInterrupt detected during day processing. Breaking out of day loop...")
-                break
-                
-            log(f"Processing unordered list {listIndex + 1}/{len(unorderedLists)}", 8, verbose)
-         
-            # Instead of prettify, let's get the raw HTML and split by <li> manually
-            # This will handle the unclosed <li> tags properly
-            ulHtml = str(unorderedList)
-            log(f"Raw UL HTML length: {len(ulHtml)}", 10, verbose)
-            
-            # Try to find the date header for this list (usually an h3 tag before the ul)
-            currentDay = "unknown"
-            if unorderedList.find_previous('h3'):
-                currentDay = unorderedList.find_previous('h3').get_text().strip()
-            
-            # Split by <li> tags but keep the <li> tag with each part
-            import re
-            liParts = re.split(r'(<li[^>]*>)', ulHtml)
-            
-            # Reconstruct individual <li> elements
-            rawMessages = []
-            for i in range(1, len(liParts), 2):  # Skip first empty part, then take every second part
-                if i + 1 < len(liParts):
-                    liTag = liParts[i]
-                    liContent = liParts[i + 1]
-                    
-                    # Remove the closing </ul> tag if present
-                    liContent = liContent.replace('</ul>', '')
-                    
-                    # Create a proper HTML element
-                    liHtml = liTag + liContent + '</li>'
-                    liElement = BeautifulSoup(liHtml, features="html.parser").find('li')
-                    if liElement:
-                        rawMessages.append(liElement)
-            
-            log(f"Found {len(rawMessages)} messages after manual parsing", 10, verbose)
-
-            # Count total messages with ts parameter for progress tracking
-            totalMessages = 0
-            for msg in rawMessages:
-                links = msg.find_all('a')
-                for link in links:
-                    if link.has_attr('href') and '?ts=' in link['href']:
-                        totalMessages += 1
-                        break
-
-            print(f"Found {totalMessages} messages to process for {currentDay}")
-            processedMessages = 0
-
-            for messageIndex, rawMessage in enumerate(rawMessages):
-                # Check for interrupt during message processing
-                if interrupt_requested:
-                    print(f"\nInterrupt detected during message processing. Breaking out of message loop...")
-                    break
-                    
-                # Periodically check for ESC key (every 10 messages to avoid performance impact)
-                if messageIndex % 10 == 0:
-                    check_for_escape()
-                    if interrupt_requested:
-                        print(f"\nInterrupt detected during message processing. Breaking out of message loop...")
-                        break
-                
-                log(f"Processing message {messageIndex + 1}/{len(rawMessages)}", 12, verbose)
+        if sourceFetcher != None and not interruptRequested.is_set() and not result['sourcesParsed']:
+            with metrics.timer('sources'):
+                sourceFetcher.attach(result)
+        mergeMonth(result, currentMonth, messages, wordsUsed, domainsUsed, linksUsed, verbose)
+        invalidATags += result['invalidATags']
 
-                try:
-                    message = {
-                        'timestamp'     : None,
-                        'hexTimestamp'  : None,
-                        'quoteCount'    : 0,
-                        'wordCount'     : 0,
-                        'sourcesCount'  : 0,
-                        'url'           : None, # this is more for examination purposes: providing the url to check the results
-                        'content'       : None, # the actual message content
-                        'contentHtml'   : None, # the raw HTML content
-                        'externalSources': []   # metadata from external sources
-                    }
-                    
-                    # Store the raw HTML content
-                    message['contentHtml'] = str(rawMessage)
-                    log("Stored raw HTML content", 14, verbose)
-                    
-                    log("Cleaning up quotes", 14, verbose)
-                    cleanMessage = cleanUpQuotes(rawMessage)
-                    message['quoteCount'] = cleanMessage['count']                
-                    cleanMessage = cleanMessage['text']
-                    log(f"Found {message['quoteCount']} quotes", 16, verbose)
-
-                    # Store the cleaned text content (without HTML tags)
-                    message['content'] = cleanMessage.get_text().strip()
-                    log("Stored cleaned text content", 14, verbose)
-
-                    # we add current month to the countWords function, this way we can analyse if used words are changing over the time,
-                    # same for countDomains, couple of lines later
-                    log("Counting words", 14, verbose)
-                    message['wordCount'] = countWords(cleanMessage, currentMonth, wordsUsed, verbose)
-                    log(f"Found {message['wordCount']} words", 16, verbose)
-
-                    links = cleanMessage.find_all('a')
-                    log(f"Found {len(links)} links", 14, verbose)
-                    
-                    if len(links) == 0:
-                        log("ERROR: No links found in message, skipping", 14, verbose)
-                        continue
-
-                    message['url'] = 'https://blog.fefe.de/' + links[0]['href']
-                    log(f"Message URL: {message['url']}", 16, verbose)
-
-                    # first get fefes secred timestamp                
-                    timestamp_match = re.search('\?ts\=(.*)', links[0]['href'])
-                    if not timestamp_match:
-                        log("ERROR: No timestamp found in first link, skipping", 14, verbose)
-                        continue
-                        
-                    hexTimestamp = timestamp_match.group(1)
-                    message['hexTimestamp'] = hexTimestamp
-                    timestamp = getTimestamp(hexTimestamp)            
-                    message['timestamp'] = timestamp
-                    log(f"Timestamp: {timestamp} (hex: {hexTimestamp})", 16, verbose)
-
-                    # then remove this first link, and get other references from this messages
-                    links.pop(0)
-                    log("Counting domains", 14, verbose)
-                    message['sourcesCount'] = countDomains(links, currentMonth, domainsUsed, verbose)
-                    log(f"Found {message['sourcesCount']} external references", 16, verbose)
-                    
-                    # Parse external sources if requested
-                    if parseSource and len(links) > 0:
-                        log("Parsing external sources for metadata", 14, verbose)
-                        message['externalSources'] = parseExternalSources(links, verbose)
-                        log(f"Parsed {len(message['externalSources'])} external sources", 16, verbose)
-                    else:
-                        message['externalSources'] = []
-
-                    if message['timestamp'] == None:
-                        log(f"WARNING: Message has no timestamp, skipping", 14, verbose)
-                        continue
-
-                    if message['hexTimestamp'] in messages:
-                        log(f"WARNING: Message with id {message['hexTimestamp']} already exists, skipping", 14, verbose)
-                        continue
-
-                    messages[message['hexTimestamp']] = message
-                    processedMessages += 1
-                    print(f"Processing {currentDay}: {processedMessages}/{totalMessages} messages", end='\r')
-                    log(f"Message {message['hexTimestamp']} successfully processed", 14, verbose)
-                    
-                except Exception as e:
-                    log(f"ERROR processing message {messageIndex + 1}: {str(e)}", 12, verbose)
-                    if verbose:
-                        import traceback
-                        traceback.print_exc()
-                    continue
+        # don't store months cut short by an interrupt
+        if not interruptRequested.is_set():
+            saveMonthState(currentMonth, result, state, verbose)
+            completedMonths.append(currentMonth)
+            saveCheckpoint(completedMonths, state)
 
-        print(f"\nCompleted processing month {currentMonth} - {processedMessages} messages processed")
-        log(f"Completed processing month {currentMonth}", 4, verbose)
+            # every checkpointEvery months the output files get updated, so they are never far behind
+            if checkpointEvery > 0 and i % checkpointEvery == checkpointEvery - 1:
+                log("Writing checkpoint after month %s", 4, verbose, currentMonth)
+                putDataToDisk(messages, wordsUsed, domainsUsed, linksUsed, verbose)
 
-        # let's go to the next month
-        startDateObj = startDateObj + relativedelta(months=+1)
+        print(f"\nCompleted processing month {currentMonth} - {result['processedMessages']} messages processed")
+        log("Completed processing month %s", 4, verbose, currentMonth)
+        metrics.tick(month=currentMonth)
 
         i += 1
-        
-        if i >= iMax:
-            log("Reached iteration limit", 4, verbose)
-            print ('\r\nReached limit')
-            break
+
+    escapeListener.stop()
+
+    # the remaining months from the scrape state, the output files are always complete
+    for storedMonth in storedMonths:
+        mergeMonth(loadMonthState(storedMonth, state), storedMonth, messages, wordsUsed, domainsUsed, linksUsed, verbose)
+        metrics.count('monthsFromState')
+
+    if i + storedCount >= iMax:
+        log("Reached iteration limit", 4, verbose)
+        print ('\r\nReached limit')
+
+    if sourceFetcher != None:
+        sourceFetcher.close()
 
     log("Starting data output", 2, verbose)
-    if interrupt_requested:
+    if interruptRequested.is_set():
         print(f"\nSaving data due to interrupt. Total messages processed so far: {len(messages)}")
-    putDataToDisk(messages, wordsUsed, domainsUsed, verbose)
+    putDataToDisk(messages, wordsUsed, domainsUsed, linksUsed, verbose)
+
+    # an interrupted run can be continued with --resume, a finished one is done
+    if not interruptRequested.is_set():
+        removeCheckpoint(state)
     
-    if interrupt_requested:
+    if interruptRequested.is_set():
         print("Data saved successfully after interrupt!")
-        log(f"Processing interrupted by user. Total messages: {len(messages)}", 0, verbose)
+        log("Processing interrupted by user. Total messages: %s", 0, verbose, len(messages))
     else:
-        log(f"Processing complete. Total messages: {len(messages)}", 0, verbose)
+        log("Processing complete. Total messages: %s", 0, verbose, len(messages))
     print ('Found {} invalid <a>-tag(s) w/o href-attribute '.format(invalidATags))
 
+    metrics.close(finished=not interruptRequested.is_set())
+    if metricsFile != None:
+        metrics.write_summary(metricsFile)
+        summary = metrics.summary()
+        print('Took {:.1f}s, {} ({})'.format(summary['elapsed'], ', '.join('{} {:.1f}s'.format(stage, values['seconds']) for stage, values in summary['stages'].items()), metricsFile))
+
 def putRawHtmlToDisk(html, currentMonth, outputFile, verbose):
     
     if outputFile != None:
         fileName = '{}{}'.format(currentMonth, outputFile)
-        log(f"Writing raw HTML to file: {fileName}", 8, verbose)
+        log("Writing raw HTML to file: %s", 8, verbose, fileName)
         resOutputFile = open(fileName, 'w', encoding='utf8')
         resOutputFile.write(html)
         resOutputFile.close()
-        log(f"Successfully wrote {len(html)} characters to {fileName}", 10, verbose)
+        log("Successfully wrote %s characters to %s", 10, verbose, len(html), fileName)
 
 
 def prepareInput(startDate, iMax, verbose):
@@ -555,8 +1318,8 @@ def prepareInput(startDate, iMax, verbose):
 
     pagesToQuery = (timeDiff.years * 12) + timeDiff. months
 
-    log(f"Date range: {startDateObj.strftime('%Y-%m')} to {endDateObj.strftime('%Y-%m')}", 6, verbose)
-    log(f"Pages to query: {pagesToQuery}, iteration limit: {iMax}", 6, verbose)
+    log("Date range: %s to %s", 6, verbose, startDateObj.strftime('%Y-%m'), endDateObj.strftime('%Y-%m'))
+    log("Pages to query: %s, iteration limit: %s", 6, verbose, pagesToQuery, iMax)
 
     print ('Start month is {}'.format(startDateObj.strftime('%Y-%m')))
     print ('End month is {}'.format(endDateObj.strftime('%Y-%m')))
@@ -572,7 +1335,11 @@ def showProgress(i, pagesToQuery):
     # flush output buffer, to get progress in real time
     sys.stdout.flush()
 
-def putDataToDisk(messages, wordsUsed, domainsUsed, verbose):
+def putDataToDisk(messages, wordsUsed, domainsUsed, linksUsed, verbose):
+    with metrics.timer('write'):
+        writeData(messages, wordsUsed, domainsUsed, linksUsed, verbose)
+
+def writeData(messages, wordsUsed, domainsUsed, linksUsed, verbose):
     
     log("Writing data to disk", 4, verbose)
     
@@ -584,44 +1351,53 @@ def putDataToDisk(messages, wordsUsed, domainsUsed, verbose):
     log("Writing domains to CSV", 6, verbose)
     writeCsvToFile(domainsUsed, 'domains.csv')
 
-    log("Converting data to JSON", 6, verbose)
-    jsonMessages = json.dumps(messages, ensure_ascii=False, indent=2)
-    jsonWordsUsed = json.dumps(wordsUsed, ensure_ascii=False, indent=2)
-    jsonDomainsUsed = json.dumps(domainsUsed, ensure_ascii=False, indent=2)
-
+    # JSON is streamed one entry at a time, instead of building the whole document as one string
     log("Writing JSON files", 6, verbose)
-    writeJsonToFile(jsonMessages, 'messages.json')
-    writeJsonToFile(jsonWordsUsed, 'words.json')
-    writeJsonToFile(jsonDomainsUsed, 'domains.json')
+    if messagesFormat == 'ndjson':
+        write_ndjson(messages.values(), 'messages.ndjson')
+    elif messagesFormat == 'sqlite':
+        log("Writing messages to SQLite", 6, verbose)
+        hosts = ((hexTimestamp, url, getDomain(url)) for hexTimestamp, urls in linksUsed.items() for url in urls)
+        links = ((hexTimestamp, url, host, registrable_domain(host)) for hexTimestamp, url, host in hosts)
+        write_sqlite(messages.values(), links, 'messages.sqlite')
+    else:
+        write_json_object(messages.items(), 'messages.json', jsonIndent)
+    write_json_object(wordsUsed.items(), 'words.json', jsonIndent)
+    write_json_object(domainsUsed.items(), 'domains.json', jsonIndent)
+    if messageIndexFile:
+        log("Updating the search index", 6, verbose)
+        index = MessageIndex(messageIndexFile, getIndexTerms)
+        log("Indexed %s new or changed messages", 8, verbose, index.update(messages.values()))
+        index.close()
+    if registrableDomains:
+        log("Writing registrable domains", 6, verbose)
+        registrableDomainsUsed = foldDomains(domainsUsed)
+        writeCsvToFile(registrableDomainsUsed, 'registrable_domains.csv')
+        write_json_object(registrableDomainsUsed.items(), 'registrable_domains.json', jsonIndent)
     
     log("All data files written successfully", 6, verbose)
 
 def writeCsvToFile(dictionary, fileName):
     
-    resFileMessages = open(fileName,'w', encoding='utf8')
-    for data in dictionary:
-        for field in dictionary[data]:
+    resFileMessages = open_atomic(fileName)
+    for data, fields in dictionary.items():
+        for field, value in fields.items():
             resFileMessages.write(str(data))
             resFileMessages.write('\t')
             resFileMessages.write(str(field))
             resFileMessages.write('\t')
-            resFileMessages.write(str(dictionary[data][field]))
+            resFileMessages.write(str(value))
             resFileMessages.write('\n')
-    resFileMessages.close()
+    commit_atomic(resFileMessages, fileName)
 
 def writeMessagesToFile(messages, fileName):
-    resFileMessages = open(fileName,'w', encoding='utf8')
+    resFileMessages = open_atomic(fileName)
     for message in messages:
         for field in messages[message]:
             resFileMessages.write(str(messages[message][field]))
             resFileMessages.write('\t')
         resFileMessages.write('\n')
-    resFileMessages.close()
-
-def writeJsonToFile(string, fileName):
-    resFile = open(fileName,'w', encoding='utf8')
-    resFile.write(string)
-    resFile.close()
+    commit_atomic(resFileMessages, fileName)
 
 def cleanUpQuotes(message):
     cleanMessage = {
@@ -637,12 +1413,12 @@ def cleanUpQuotes(message):
 
 
 
-def parseExternalSources(links, verbose):
+def getExternalSourceUrls(links):
     """
-    Parse multiple external links to extract metadata.
-    Returns a list of metadata dictionaries.
+    Get the urls of external links, that we want to fetch meta data from.
+    Returns a list of urls.
     """
-    external_sources = []
+    urls = []
     
     for link in links:
         if link.has_attr('href'):
@@ -660,15 +1436,33 @@ def parseExternalSources(links, verbose):
         if not href.startswith('http'):
             continue
             
-        metadata = parseExternalSource(href, verbose)
-        if metadata:
-            external_sources.append(metadata)
+        urls.append(href)
     
-    return external_sources
+    return urls
+
+def getDomain(href):
+    """
+    Get the domain a link points to, 'self' if fefe references himself. Hosts are
+    normalized (case, port, userinfo, leading www.) and cached, see domain_names.
+    """
+    return host_of(href)
+
+def foldDomains(domainsUsed):
+    """
+    Fold the counts of hosts into counts of registrable domains (news.bbc.co.uk -> bbc.co.uk).
+    Returns a new TermCounts with the same months.
+    """
+    registrableDomainsUsed = TermCounts()
+    for month in domainsUsed.months:
+        folded = Counter()
+        for domain, count in domainsUsed.getMonth(month).items():
+            folded[registrable_domain(domain)] += count
+        registrableDomainsUsed.add(month, folded)
+    return registrableDomainsUsed
 
 def countDomains(domains, currentMonth, domainsUsed, verbose):    
 
-    log(f"Counting domains for {len(domains)} links", 16, verbose)
+    log("Counting domains for %s links", 16, verbose, len(domains))
 
     for index, value in enumerate(domains, start=0):
 
@@ -677,35 +1471,25 @@ def countDomains(domains, currentMonth, domainsUsed, verbose):
         elif value.has_attr('ref'):
             href = value['ref']
         else:
-            log(f"Link {index} has no href or ref attribute, skipping", 18, verbose)
+            log("Link %s has no href or ref attribute, skipping", 18, verbose, index)
             continue
 
-        # does fefe references himself?
-        if href[:5] == '/?ts=' or href[:4] == '?ts=':
-            domain = 'self'
-        # otherwise it's an external reference
-        else: 
-            domain = href.split('//')[-1].split('/')[0]
-            domain = re.sub('www[\d\.]*', '', domain)
+        domain = getDomain(href)
 
-        log(f"Link {index}: {domain}", 18, verbose)
+        log("Link %s: %s", 18, verbose, index, domain)
 
-        if domain in domainsUsed[currentMonth]:
-            domainsUsed[currentMonth][domain] += 1
-        else:
-            domainsUsed[currentMonth][domain] = 1
-
-        if domain in domainsUsed['sum']:
-            domainsUsed['sum'][domain] += 1
-        else:
-            domainsUsed['sum'][domain] = 1
+        domainsUsed[currentMonth][domain] += 1
 
     return len(domains)
 
-def countWords(string, currentMonth, wordsUsed, verbose):
+def getWords(text):
+    """
+    Normalize the text of a message and split it into words. Returns the number of words and
+    the cleaned words, including the ones that are too short to be counted.
+    """
 
     # remove self reference / link to current post
-    cleanString = string.getText().replace('[l] ', '')
+    cleanString = text.replace('[l] ', '')
                     
     # problem: getText() returns all text, also from child elements, and it removes html tags
     # this will connect end of sentences with starting tags, s, e.g.:
@@ -714,40 +1498,40 @@ def countWords(string, currentMonth, wordsUsed, verbose):
     # as fefe tends to  exaggerate (usage of 1!1!11!elf!1!), elf will finally be considered as a single word
     # e.g.: oder?!elf!?!?update will be oder?! elf!?!?!? update
 
-    cleanString = re.sub(r'(([\:\.\!\?1]+)([a-zA-Z1-9]+))', r'\2 \3', cleanString)
+    cleanString = sentenceJoinRegEx.sub(r'\2 \3', cleanString).lower()
         
     # splitt the text based on spaces
-    # also transform to lower case
-    words = cleanString.lower().split()
+    wordCount = len(cleanString.split())
+
+    # remove unwanted stuff from all words in one go, whitespace stays, so splitting gives the same
+    # words as cleaning every single word, words consisting only of unwanted stuff simply vanish
+    return wordCount, ignoreCharsRegEx.sub('', cleanString).split()
+
+def getIndexTerms(text):
+    """
+    The words of a message countWords counts, as (position, word), for the search index. Positions
+    are the ones in the cleaned text, so phrases still match when short words were dropped.
+    """
+    return [(position, word) for position, word in enumerate(getWords(text)[1]) if len(word) >= minWordLength and not word[0].isdigit()]
+
+def countWords(text, currentMonth, wordsUsed, verbose):
+    """
+    Count the words of a message into wordsUsed[currentMonth] (a Counter), the sum over all
+    months is derived from the months later on, see mergeMonth. Returns the number of words.
+    """
+
+    wordCount, words = getWords(text)
     
-    log(f"Processing {len(words)} words", 16, verbose)
-
-    validWords = 0
-    for word in words:
-        # remove unwanted stuff
-        # strip will only remove pre- and suffixes, but i prefer the stronger reEx replace to 
-        # get a cleaner result
-        # cleanWord = word.strip(ignoreChars)
-        cleanWord = re.sub(ignoreCharsRegEx, '', word)
-
-        # only keep words with at least minWordLenght characters
-        # and also ignore "words" starting with a number, because than it is not a word (by my definition) 
-        # this will remove a lot of dirt
-        if len(cleanWord) >= minWordLength and not cleanWord[0].isdigit():
-            validWords += 1
-            
-            if cleanWord in wordsUsed['sum']:
-                wordsUsed['sum'][cleanWord] += 1
-            else:
-                wordsUsed['sum'][cleanWord] = 1
+    log("Processing %s words", 16, verbose, wordCount)
 
-            if cleanWord in wordsUsed[currentMonth]:
-                wordsUsed[currentMonth][cleanWord] += 1
-            else:
-                wordsUsed[currentMonth][cleanWord] = 1
+    # only keep words with at least minWordLenght characters
+    # and also ignore "words" starting with a number, because than it is not a word (by my definition) 
+    # this will remove a lot of dirt
+    validWords = [word for word in words if len(word) >= minWordLength and not word[0].isdigit()]
+    wordsUsed[currentMonth].update(validWords)
 
-    log(f"Found {validWords} valid words (min length: {minWordLength})", 18, verbose)
-    return len(words)
+    log("Found %s valid words (min length: %s)", 18, verbose, len(validWords), minWordLength)
+    return wordCount
 
 def getTimestamp(fefeTimestamp):
     # convert hexa decimal value to decimal value
@@ -787,32 +1571,165 @@ def getParameters():
                         action='store_true',
                         help='parse external links to extract meta data like titles from linked sources')
 
+    parser.add_argument('--source-workers',
+                        type=int,
+                        default=16,
+                        help='number of external sources to fetch concurrently with --parse-source, default is 16')
+
+    parser.add_argument('--source-host-limit',
+                        type=int,
+                        default=2,
+                        help='number of concurrent requests per host with --parse-source, default is 2')
+
+    parser.add_argument('--source-cache',
+                        default='sources.sqlite',
+                        help='file for caching meta data of external sources across runs, set to an empty string to disable caching, default is sources.sqlite')
+
+    parser.add_argument('--source-cache-ttl',
+                        type=float,
+                        default=30,
+                        help='days until cached meta data of external sources is fetched again, default is 30')
+
+    parser.add_argument('--source-cache-negative-ttl',
+                        type=float,
+                        default=1,
+                        help='days until failed external sources are tried again, default is 1')
+
+    parser.add_argument('--source-cache-size',
+                        type=int,
+                        default=200000,
+                        help='maximum number of cached external sources, least recently used ones are evicted, default is 200000')
+
     parser.add_argument('--force',
                         action='store_true',
                         help='force reprocessing of months that have already been processed')
 
+    parser.add_argument('--state',
+                        default='scrape_state',
+                        help='directory for the scrape state, months parsed completely in former runs are taken from there instead of fetching them again, set to an empty string to disable, default is scrape_state')
+
+    parser.add_argument('--format',
+                        choices=['json', 'ndjson', 'sqlite'],
+                        default='json',
+                        help='format of the messages file: json writes messages.json, ndjson writes messages.ndjson with one message per line, sqlite writes messages.sqlite with indexes on time, month and linked domains, default is json')
+
+    parser.add_argument('--compact',
+                        action='store_true',
+                        help='write JSON files without indentation')
+
+    parser.add_argument('--registrable-domains',
+                        action='store_true',
+                        help='also write registrable_domains.json/.csv with the domain counts folded to registrable domains (news.bbc.co.uk -> bbc.co.uk), see public_suffixes.txt')
+
+    parser.add_argument('--index',
+                        default='',
+                        help='update a full-text index of the messages in this SQLite file, search it with message_index.py, e.g. index.sqlite, default is no index')
+
+    parser.add_argument('--metrics',
+                        default='metrics.json',
+                        help='write timings per stage (fetch, sanitize, segment, parse, countWords, countDomains, sources, write), bytes, messages per second and cache hits of the run to this JSON file, set to an empty string to disable, default is metrics.json')
+
+    parser.add_argument('--metrics-log',
+                        default='',
+                        help='append the metrics as one line of NDJSON to this file every --metrics-interval seconds during the run, default is no log')
+
+    parser.add_argument('--metrics-interval',
+                        type=float,
+                        default=60,
+                        help='seconds between two lines of --metrics-log, default is 60')
+
+    parser.add_argument('--checkpoint-every',
+                        type=int,
+                        default=12,
+                        help='write the output files after every n months, so a crash does not lose everything, 0 writes them only at the end, default is 12')
+
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='continue an interrupted or crashed run after the last completed month (requires --state)')
+
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=1,
+                        help='number of months to fetch concurrently, parsing stays in chronological order, default is 1 (sequential)')
+
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        help='number of processes parsing months in parallel, useful with --input, default is 1')
+
+    parser.add_argument('--base-url',
+                        default='https://blog.fefe.de/',
+                        help='base url of the blog, e.g. http://localhost:8000/ to run against a local copy of saved monthly pages')
+
+    parser.add_argument('--rate-limit',
+                        type=float,
+                        default=4,
+                        help='requests per second to a single host, blog.fefe.de and external sources alike, 0 disables the limit, default is 4')
+
+    parser.add_argument('--retries',
+                        type=int,
+                        default=3,
+                        help='retries of a request after timeouts, connection errors, 429 and 5xx, with exponential backoff, default is 3')
+
+    parser.add_argument('--breaker-threshold',
+                        type=int,
+                        default=5,
+                        help='consecutive failures after which a host is given up for --breaker-cooldown seconds, default is 5')
+
+    parser.add_argument('--breaker-cooldown',
+                        type=float,
+                        default=60,
+                        help='seconds until a given up host is tried again, default is 60')
+
     if len(sys.argv) == 1:
         parser.print_help()
         sys.exit(0)
     args = parser.parse_args()
     
-    startDate = args.start
-    inputFile = args.input
-    outputFile = args.output
-    iMax = args.limit
-    verbose = args.verbose
-    parseSource = args.parse_source
-    force = args.force
-
-    if startDate == None and inputFile == None:
+    if args.start == None and args.input == None:
         print ('\r\n!!!Start date or input file are not provided. At least one is required!!! \r\n')
         parser.print_help()
         sys.exit(-1)
+
+    if args.resume and not args.state:
+        print ('\r\n!!!--resume needs the scrape state, --state must not be empty!!! \r\n')
+        parser.print_help()
+        sys.exit(-1)
+
+    if args.workers < 1 or args.jobs < 1 or args.source_workers < 1 or args.source_host_limit < 1:
+        print ('\r\n!!!Number of workers and host limit have to be at least 1!!! \r\n')
+        parser.print_help()
+        sys.exit(-1)
+
+    if args.rate_limit < 0 or args.retries < 0 or args.breaker_threshold < 1:
+        print ('\r\n!!!Rate limit and retries must not be negative, the breaker threshold has to be at least 1!!! \r\n')
+        parser.print_help()
+        sys.exit(-1)
     
-    return startDate, inputFile, outputFile, iMax, verbose, parseSource, force
+    return args
 
 if __name__ == '__main__':
      
-    startDate, inputFile, outputFile, iMax, verbose, parseSource, force = getParameters()
-
-    getMessages(startDate, inputFile, outputFile, iMax, verbose, parseSource, force)
+    args = getParameters()
+    configureLogging(args.verbose)
+
+    urlTemplate = args.base_url + '?mon='
+    messagesFormat = args.format
+    jsonIndent = None if args.compact else 2
+    registrableDomains = args.registrable_domains
+    messageIndexFile = args.index or None
+    metricsFile = args.metrics or None
+    if args.metrics_log:
+        metrics.open_log(args.metrics_log, args.metrics_interval)
+    httpClient = HttpClient(rate=args.rate_limit, burst=max(1, int(2 * args.rate_limit)), retries=args.retries,
+                            breaker_threshold=args.breaker_threshold, breaker_cooldown=args.breaker_cooldown,
+                            metrics=metrics, stop=interruptRequested)
+
+    sourceFetcher = None
+    if args.parse_source:
+        sourceCache = None
+        if args.source_cache:
+            sourceCache = SourceCache(args.source_cache, args.source_cache_ttl * 86400, args.source_cache_negative_ttl * 86400, args.source_cache_size, args.verbose)
+        sourceFetcher = ExternalSourceFetcher(args.source_workers, args.source_host_limit, sourceCache, args.verbose)
+
+    getMessages(args.start, args.input, args.output, args.limit, args.verbose, sourceFetcher, args.force, args.workers, args.jobs, args.state or None, args.checkpoint_every, args.resume)
@@ -0,0 +1,148 @@
+"""
+The HTML of a post as phase1_prepare_raw_data.py sees it, without a BeautifulSoup tree.
+
+The topic extraction only needs the external anchors and, after the first one, the
+nearest blockquote and the next sentence, found by walking next_element. Building
+BeautifulSoup(html, "html.parser") for that creates, links and later frees an object
+for every tag and string of the post. FlatDocument gets the same events from the
+html.parser front end of bs4 (BeautifulSoupHTMLParser, so tokenizing, entities,
+duplicate attributes and void elements are bs4's) and records the nodes in one flat
+list instead, in the order next_element walks them, with the end of every tag. The
+rules of the tree builder that decide this order (closing unclosed and mismatched
+tags, which strings count for get_text) are replicated here.
+`./benchmark.py extractor` checks that both give the same topics.
+"""
+
+from bs4.builder import HTMLTreeBuilder
+from bs4.builder._htmlparser import BeautifulSoupHTMLParser
+from bs4.element import CData
+
+from prompt_template import normalize_whitespace
+
+EMPTY_ELEMENT_TAGS = frozenset(HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS)
+# strings in these tags (<script>, <style>, ...) are not part of get_text
+STRING_CONTAINERS = frozenset(HTMLTreeBuilder.DEFAULT_STRING_CONTAINERS)
+
+# steps of next_element nearest_blockquote_after and next_sentence_after go at most
+BLOCKQUOTE_STEPS = 20
+SENTENCE_STEPS = 60
+
+
+class OpenedTag:
+    """What BeautifulSoupHTMLParser asks of a tag it opened."""
+
+    def __init__(self, is_empty_element):
+        self.is_empty_element = is_empty_element
+
+
+EMPTY_ELEMENT = OpenedTag(True)
+ELEMENT = OpenedTag(False)
+
+
+class FlatDocument:
+    """
+    Nodes of a post in document order: `names[i]` is the name of a tag, None for a
+    string, `strings[i]` the text of a string, None for a tag; `ends[i]` is the index
+    after the last descendant of the tag at i. `anchors` are (index, attributes) of
+    the <a> tags. Takes the place of the BeautifulSoup object in BeautifulSoupHTMLParser,
+    hence the camelCase methods.
+    """
+
+    # read by BeautifulSoupHTMLParser
+    attribute_dict_class = dict
+    store_line_numbers = False
+
+    def __init__(self):
+        self.builder = self
+        self.names = []
+        self.strings = []
+        # True for the strings get_text(" ", strip=True) of a tag returns, not for comments, scripts, ...
+        self.visible = []
+        self.ends = {}
+        self.anchors = []
+        self.data = []
+        # indexes of the open tags, and of the open tags in STRING_CONTAINERS
+        self.stack = []
+        self.containers = []
+        self.open_tags = {}
+        self.contains_replacement_characters = False
+
+    @classmethod
+    def parse(cls, html):
+        document = cls()
+        parser = BeautifulSoupHTMLParser(document, convert_charrefs=False)
+        parser.feed(html)
+        parser.close()
+        document.endData()
+        while document.stack:
+            document.popTag()
+        return document
+
+    def handle_starttag(self, name, namespace, nsprefix, attrs, sourceline=None, sourcepos=None):
+        self.endData()
+        index = len(self.names)
+        self.names.append(name)
+        self.strings.append(None)
+        self.visible.append(False)
+        self.stack.append(index)
+        self.open_tags[name] = self.open_tags.get(name, 0) + 1
+        if name in STRING_CONTAINERS:
+            self.containers.append(index)
+        if name == "a":
+            self.anchors.append((index, attrs))
+        return EMPTY_ELEMENT if name in EMPTY_ELEMENT_TAGS else ELEMENT
+
+    def handle_endtag(self, name, nsprefix=None):
+        self.endData()
+        # like BeautifulSoup._popToTag: close everything up to the last open tag of that name, if there is one
+        if not self.open_tags.get(name):
+            return
+        while self.stack:
+            if self.names[self.popTag()] == name:
+                return
+
+    def popTag(self):
+        index = self.stack.pop()
+        self.ends[index] = len(self.names)
+        self.open_tags[self.names[index]] -= 1
+        if self.containers and self.containers[-1] == index:
+            self.containers.pop()
+        return index
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def endData(self, containerClass=None):
+        if not self.data:
+            return
+        self.names.append(None)
+        self.strings.append("".join(self.data))
+        # plain strings outside of <script>, <style>, ... and CDATA sections, see Tag.MAIN_CONTENT_STRING_TYPES
+        self.visible.append(containerClass is CData or (containerClass is None and not self.containers))
+        self.data = []
+
+    def text(self, index):
+        """normalize_whitespace(tag.get_text(" ", strip=True)) of the tag at index."""
+        return normalize_whitespace(" ".join(
+            self.strings[i] for i in range(index + 1, self.ends[index]) if self.visible[i]))
+
+    def nearest_blockquote_after(self, index, max_chars=140):
+        """phase1_prepare_raw_data.nearest_blockquote_after of the tag at index."""
+        for i in range(index + 1, min(index + 1 + BLOCKQUOTE_STEPS, len(self.names))):
+            if self.names[i] == "blockquote":
+                return self.text(i)[:max_chars]
+        return ""
+
+    def next_sentence_after(self, index, max_chars=140):
+        """phase1_prepare_raw_data.next_sentence_after of the tag at index."""
+        buf = []
+        for i in range(index + 1, min(index + 1 + SENTENCE_STEPS, len(self.names))):
+            if self.strings[i] is None:
+                continue
+            t = normalize_whitespace(self.strings[i])
+            if t:
+                buf.append(t)
+                joined = " ".join(buf)
+                if joined.endswith((".", "!", "?")) or len(joined) >= max_chars:
+                    return joined[:max_chars]
+        return " ".join(buf)[:max_chars]
@@ -0,0 +1,306 @@
+"""
+HTTP access of the scraper, shared by the monthly pages and the external sources.
+
+Every request goes through three per-host guards:
+
+- a token bucket, so a host gets at most `rate` requests per second (with bursts
+  of up to `burst` requests), no matter how many threads fetch from it;
+- retries with exponential backoff and full jitter on timeouts, connection errors,
+  429 and 5xx. A Retry-After header is honoured and pauses the whole host, not
+  only the request that got it;
+- a circuit breaker: after `breaker_threshold` consecutive failures a host is
+  given up for `breaker_cooldown` seconds, requests fail at once with
+  HostUnavailable. After the cooldown one request is let through to probe it.
+
+Connections are kept alive per thread and host.
+"""
+
+import email.utils
+import http.client
+import random
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+
+# status codes that are worth another try
+RETRY_STATUS = (429, 500, 502, 503, 504)
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+
+# streamed responses are read in chunks of this size
+CHUNK_SIZE = 16384
+
+
+class HostUnavailable(urllib.error.URLError):
+    """The circuit breaker of a host is open, the request was not sent."""
+
+
+class IncompleteStream(Exception):
+    """A streamed response broke off after the consumer got a part of it, it can't be retried."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket of one host, refilled with `rate` tokens per second up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        # set by Retry-After, no token is handed out before
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token. Returns the seconds to wait before it may be used."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """Consecutive failures of a host, open means the host is skipped until the cooldown is over."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened is None:
+                return True
+            # half open: after the cooldown a single request may probe the host
+            if not self.probing and time.monotonic() - self.opened >= self.cooldown:
+                self.probing = True
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.probing = False
+
+    def failure(self):
+        """Count a failure. Returns True if this opened the breaker."""
+        with self.lock:
+            self.failures += 1
+            if self.probing or (self.opened is None and self.failures >= self.threshold):
+                self.opened = time.monotonic()
+                self.probing = False
+                return True
+            return False
+
+
+def retry_after(value):
+    """Seconds of a Retry-After header, either delta seconds or an HTTP date. None if missing or invalid."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class HttpClient:
+    """
+    GET requests with per-host rate limiting, retries and circuit breakers, see the module
+    docstring. `rate` 0 disables the rate limit, `retries` 0 the retries. Counters
+    (httpRequests, httpRetries, httpRateLimitWaits, ...) go to `metrics` if one is given,
+    waits end early when `stop` (a threading.Event) is set.
+    """
+
+    def __init__(self, rate=4.0, burst=8, retries=3, backoff=0.5, max_backoff=30.0, max_retry_after=120.0,
+                 breaker_threshold=5, breaker_cooldown=60.0, headers=None, metrics=None, stop=None):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.headers = headers or {}
+        self.metrics = metrics
+        self.stop = stop
+        self.buckets = {}
+        self.breakers = {}
+        self.lock = threading.Lock()
+        # every thread keeps its own keep-alive connections, keyed by (scheme, host, port, verify)
+        self.pool = threading.local()
+        self.insecure_context = ssl.create_default_context()
+        self.insecure_context.check_hostname = False
+        self.insecure_context.verify_mode = ssl.CERT_NONE
+
+    def count(self, name, value=1):
+        if self.metrics is not None:
+            self.metrics.count(name, value)
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        if self.stop is None:
+            time.sleep(seconds)
+        elif self.stop.wait(seconds):
+            raise urllib.error.URLError("interrupted")
+
+    def guards(self, host):
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+                if self.rate > 0:
+                    self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets.get(host), self.breakers[host]
+
+    def connection(self, scheme, host, port, timeout, verify):
+        """A keep-alive connection of the current thread. Returns a tuple (connection, reused)."""
+        if not hasattr(self.pool, "connections"):
+            self.pool.connections = {}
+        key = (scheme, host, port, verify)
+        if key in self.pool.connections:
+            return self.pool.connections[key], True
+        if scheme == "https":
+            context = ssl.create_default_context() if verify else self.insecure_context
+            connection = http.client.HTTPSConnection(host, port, timeout=timeout, context=context)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        self.pool.connections[key] = connection
+        return connection, False
+
+    def drop(self, scheme, host, port, verify):
+        connection = self.pool.connections.pop((scheme, host, port, verify), None)
+        if connection is not None:
+            connection.close()
+
+    def get(self, url, headers=None, timeout=10, consumer=None, max_bytes=None, max_redirects=5, verify=False):
+        """
+        GET an url, following redirects. Returns a tuple (status, headers, body).
+        If a consumer is given, a successful response is streamed to it chunk by chunk instead,
+        until it returns True or max_bytes are read, body is None then.
+        Raises HostUnavailable for hosts with an open circuit breaker, the last error if all
+        retries failed; a 429 or 5xx after the last retry is returned like any other status.
+        """
+        for redirect in range(max_redirects + 1):
+            status, response_headers, body = self.request(url, headers, timeout, consumer, max_bytes, verify)
+            location = response_headers.get("Location")
+            if status in REDIRECT_STATUS and location:
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return status, response_headers, body
+        raise urllib.error.URLError("too many redirects for {}".format(url))
+
+    def request(self, url, headers, timeout, consumer, max_bytes, verify):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise urllib.error.URLError("unsupported url {}".format(url))
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        bucket, breaker = self.guards(parts.hostname)
+
+        for attempt in range(self.retries + 1):
+            if not breaker.allow():
+                self.count("httpCircuitOpen")
+                raise HostUnavailable("{} is unavailable after repeated failures".format(parts.hostname))
+            if bucket is not None:
+                wait = bucket.reserve()
+                if wait > 0:
+                    self.count("httpRateLimitWaits")
+                    self.sleep(wait)
+
+            self.count("httpRequests")
+            delay = None
+            try:
+                status, response_headers, body = self.send(parts, path, headers, timeout, consumer, max_bytes, verify)
+            except ssl.SSLCertVerificationError:
+                # not a problem of the host being down, the caller decides what to do about it
+                breaker.success()
+                raise
+            except (http.client.HTTPException, OSError):
+                # no more retries once the host is given up
+                opened = breaker.failure()
+                if opened:
+                    self.count("httpCircuitOpened")
+                if opened or attempt >= self.retries:
+                    raise
+            else:
+                if status not in RETRY_STATUS:
+                    breaker.success()
+                    return status, response_headers, body
+                # a host answering 429 is alive, only 5xx count towards the breaker
+                opened = status != 429 and breaker.failure()
+                if opened:
+                    self.count("httpCircuitOpened")
+                if opened or attempt >= self.retries:
+                    return status, response_headers, body
+                delay = retry_after(response_headers.get("Retry-After"))
+                if delay is not None:
+                    if delay > self.max_retry_after:
+                        return status, response_headers, body
+                    if bucket is not None:
+                        bucket.pause(delay)
+
+            if delay is None:
+                # full jitter, so threads that failed together don't come back together
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            self.count("httpRetries")
+            self.sleep(delay)
+
+    def send(self, parts, path, headers, timeout, consumer, max_bytes, verify):
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+
+        # a reused connection may have been closed by the server in the meantime, so give it a second try
+        for attempt in range(2):
+            connection, reused = self.connection(parts.scheme, parts.hostname, parts.port, timeout, verify)
+            try:
+                connection.request("GET", path, headers=request_headers)
+                response = connection.getresponse()
+                body = None
+                if consumer is None or response.status != 200:
+                    body = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                self.drop(parts.scheme, parts.hostname, parts.port, verify)
+                if not reused or attempt > 0:
+                    raise
+
+        if body is None:
+            bytes_read = 0
+            done = False
+            while not done:
+                try:
+                    chunk = response.read1(CHUNK_SIZE)
+                except (http.client.HTTPException, OSError) as e:
+                    self.drop(parts.scheme, parts.hostname, parts.port, verify)
+                    if bytes_read:
+                        raise IncompleteStream(str(e)) from e
+                    raise
+                if not chunk:
+                    break
+                bytes_read += len(chunk)
+                done = consumer(chunk) or (max_bytes is not None and bytes_read >= max_bytes)
+            # the rest of the response is still on the wire, so this connection can't be reused
+            if done:
+                self.drop(parts.scheme, parts.hostname, parts.port, verify)
+
+        if response.will_close:
+            self.drop(parts.scheme, parts.hostname, parts.port, verify)
+        return response.status, response.headers, body
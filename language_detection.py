@@ -0,0 +1,106 @@
+"""
+Language of the topics and contexts in phase1_prepare_raw_data.py.
+
+langdetect is slow (it samples n-grams in several random trials per call) and
+most of fefe's topics are obviously German. So stopwords and umlauts decide
+the clear German and English cases first, langdetect is only asked when that
+is not conclusive. It is seeded, so a text always gets the same language, and
+every result is memoized by the normalized text. Optionally the top level
+domain of the linked source (.de, .at) decides undecided texts before langdetect.
+"""
+
+import re
+
+from langdetect import DetectorFactory, LangDetectException, detect
+
+# langdetect samples n-grams at random, with a fixed seed a text always gets the same
+# language, no matter in which process or in which order it is detected
+DetectorFactory.seed = 0
+
+DEFAULT_LANGUAGE = "de"
+MIN_LENGTH = 20
+CACHE_SIZE = 100000
+
+WORD_REGEX = re.compile(r"[^\W\d_]+")
+WHITESPACE_REGEX = re.compile(r"\s+")
+
+# frequent function words, without those both languages share ("in", "an", "so", "was", "will", ...)
+GERMAN_STOPWORDS = frozenset(
+    "der die das den dem des ein eine einen einem einer eines und oder aber nicht ist sind war "
+    "wird werden wurde hat haben hatte sich auch noch nur schon wie wenn dass daß mit von für "
+    "auf aus bei nach über vor zum zur im ins vom ich wir ihr sie er es uns euch kein keine "
+    "mehr jetzt hier dies diese dieser doch mal ja wohl".split()
+)
+ENGLISH_STOPWORDS = frozenset(
+    "the of and to is are were be been has have had not this that these those with from for "
+    "on by at it its as or but which who what when where they their them we our you your "
+    "he she his her would could should can just about into than".split()
+)
+GERMAN_LETTERS = frozenset("äöüß")
+
+# sources on these top level domains are taken as German with the domain hint
+GERMAN_TLDS = (".de", ".at")
+
+
+def normalize(text):
+    """Collapse whitespace, langdetect does not see a difference either."""
+    return WHITESPACE_REGEX.sub(" ", text).strip()
+
+
+def prefilter(text):
+    """
+    'de' or 'en' if the stopwords (and umlauts, counting as German) of a text leave
+    no doubt, None if langdetect has to decide.
+    """
+    text = text.lower()
+    german = english = 0
+    for word in WORD_REGEX.findall(text):
+        if word in GERMAN_STOPWORDS:
+            german += 1
+        elif word in ENGLISH_STOPWORDS:
+            english += 1
+    if not GERMAN_LETTERS.isdisjoint(text):
+        german += 2
+    if german >= 2 and german >= 3 * english:
+        return "de"
+    if english >= 3 and english >= 3 * german:
+        return "en"
+    return None
+
+
+class LanguageDetector:
+    """
+    Detect the language of a text, see the module docstring. `detect` returns the language
+    and how it was found ('short', 'cache', 'prefilter', 'domain' or 'langdetect'), so callers
+    can count the calls that never reached langdetect.
+    """
+
+    def __init__(self, domain_hint=False, cache_size=CACHE_SIZE):
+        self.domain_hint = domain_hint
+        self.cache_size = cache_size
+        self.cache = {}
+
+    def detect(self, text, domain=None):
+        if not text or len(text) < MIN_LENGTH:
+            return DEFAULT_LANGUAGE, "short"
+        key = normalize(text)
+        if key in self.cache:
+            return self.cache[key], "cache"
+
+        language = prefilter(key)
+        method = "prefilter"
+        if language is None and self.domain_hint and domain and domain.endswith(GERMAN_TLDS):
+            # the domain is not memoized, the same text may link somewhere else next time
+            return DEFAULT_LANGUAGE, "domain"
+        if language is None:
+            method = "langdetect"
+            try:
+                language = detect(key)
+            except LangDetectException:
+                language = DEFAULT_LANGUAGE
+
+        if len(self.cache) >= self.cache_size:
+            # drop the oldest entry, dictionaries keep the insertion order
+            del self.cache[next(iter(self.cache))]
+        self.cache[key] = language
+        return language, method
@@ -0,0 +1,291 @@
+#!./.venv/bin/python3
+
+"""
+Full-text search over the messages scraped by fefe.py.
+
+The index is a SQLite file with one posting per (word, message), so AND queries
+are an intersection of posting lists. The positions of the words are kept in a
+table of their own, they are only read to check phrases. Words are taken from
+message['content'] with the tokenization of fefe.countWords (fefe.getIndexTerms).
+Updates are incremental: messages whose content did not change are skipped.
+
+    ./message_index.py build messages.json --index index.sqlite
+    ./message_index.py search 'vorratsdatenspeicherung "bundesverfassungsgericht urteil"' --from 201001 --to 201012
+"""
+
+import argparse
+import hashlib
+import re
+import sqlite3
+import time
+from array import array
+from collections import Counter
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    term TEXT NOT NULL UNIQUE,
+    documents INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    hex_timestamp TEXT NOT NULL UNIQUE,
+    timestamp TEXT,
+    month TEXT,
+    hash TEXT
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term_id INTEGER NOT NULL,
+    document_id INTEGER NOT NULL,
+    PRIMARY KEY (term_id, document_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS positions (
+    term_id INTEGER NOT NULL,
+    document_id INTEGER NOT NULL,
+    positions BLOB NOT NULL,
+    PRIMARY KEY (term_id, document_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_document ON postings (document_id);
+CREATE INDEX IF NOT EXISTS documents_month ON documents (month);
+CREATE INDEX IF NOT EXISTS documents_timestamp ON documents (timestamp, id);
+"""
+
+# a quoted phrase or a single word of a query
+QUERY_REGEX = re.compile(r'"([^"]*)"|(\S+)')
+
+# below this number of candidates, postings and documents are looked up one by one instead of reading them all,
+# also when the candidates are much fewer than the documents of a term (SQLite allows 32766 parameters per query)
+LOOKUP_CANDIDATES = 1000
+LOOKUP_RATIO = 10
+MAX_LOOKUPS = 30000
+
+
+def content_hash(message):
+    return hashlib.sha256((message.get("content") or "").encode("utf8")).hexdigest()
+
+
+class MessageIndex:
+    """
+    Inverted index of messages in a SQLite file. `terms_of(text)` returns the (position, word)
+    pairs of a text, fefe.getIndexTerms; queries are split into words by the same function.
+    """
+
+    def __init__(self, path, terms_of):
+        self.path = path
+        self.terms_of = terms_of
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(INDEX_SCHEMA)
+        self.term_ids = None
+
+    def close(self):
+        self.connection.close()
+
+    def term_id(self, term):
+        if self.term_ids is None:
+            self.term_ids = dict(self.connection.execute("SELECT term, id FROM terms"))
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.connection.execute("INSERT INTO terms (term) VALUES (?)", (term,)).lastrowid
+            self.term_ids[term] = term_id
+        return term_id
+
+    def update(self, messages):
+        """
+        Add new messages and re-index changed ones, unchanged messages are skipped.
+        Returns the number of (re-)indexed messages.
+        """
+        known = {hex_timestamp: (document_id, digest) for document_id, hex_timestamp, digest in
+                 self.connection.execute("SELECT id, hex_timestamp, hash FROM documents")}
+        updated = 0
+        # number of documents per term, to intersect starting with the rarest term
+        frequencies = Counter()
+        with self.connection:
+            for message in messages:
+                hex_timestamp = message["hexTimestamp"]
+                digest = content_hash(message)
+                document_id, known_digest = known.get(hex_timestamp, (None, None))
+                if known_digest == digest:
+                    continue
+                timestamp = message.get("timestamp")
+                month = (timestamp or "")[:7].replace("-", "")
+                if document_id is None:
+                    document_id = self.connection.execute(
+                        "INSERT INTO documents (hex_timestamp, timestamp, month, hash) VALUES (?, ?, ?, ?)",
+                        (hex_timestamp, timestamp, month, digest),
+                    ).lastrowid
+                else:
+                    removed = [term_id for term_id, in self.connection.execute(
+                        "SELECT term_id FROM postings WHERE document_id = ?", (document_id,))]
+                    frequencies.subtract(removed)
+                    self.connection.execute("DELETE FROM postings WHERE document_id = ?", (document_id,))
+                    self.connection.executemany(
+                        "DELETE FROM positions WHERE term_id = ? AND document_id = ?", ((term_id, document_id) for term_id in removed))
+                    self.connection.execute(
+                        "UPDATE documents SET timestamp = ?, month = ?, hash = ? WHERE id = ?",
+                        (timestamp, month, digest, document_id),
+                    )
+                known[hex_timestamp] = (document_id, digest)
+
+                positions = {}
+                for position, word in self.terms_of(message.get("content") or ""):
+                    positions.setdefault(self.term_id(word), array("I")).append(position)
+                self.connection.executemany("INSERT INTO postings VALUES (?, ?)", ((term_id, document_id) for term_id in positions))
+                self.connection.executemany(
+                    "INSERT INTO positions VALUES (?, ?, ?)",
+                    ((term_id, document_id, term_positions.tobytes()) for term_id, term_positions in positions.items()),
+                )
+                frequencies.update(positions.keys())
+                updated += 1
+            self.connection.executemany(
+                "UPDATE terms SET documents = documents + ? WHERE id = ?",
+                ((change, term_id) for term_id, change in frequencies.items() if change),
+            )
+        return updated
+
+    def parse_query(self, query):
+        """
+        Split a query into phrases, every phrase is a list of (offset, word); an unquoted word
+        is a phrase of its own. Words countWords would not count (too short, numbers) are ignored.
+        """
+        phrases = []
+        for quoted, word in QUERY_REGEX.findall(query):
+            terms = self.terms_of(quoted or word)
+            if terms:
+                phrases.append([(position - terms[0][0], term) for position, term in terms])
+        return phrases
+
+    @staticmethod
+    def lookup(candidates, frequency):
+        """Look up the candidates one by one or read all documents of a term?"""
+        return len(candidates) < LOOKUP_CANDIDATES or (len(candidates) * LOOKUP_RATIO < frequency and len(candidates) < MAX_LOOKUPS)
+
+    def postings(self, term, month_from, month_to, candidates):
+        """Ids of the documents containing a term, limited to a month range and to the candidates found so far."""
+        term_id, frequency = term
+        query = "SELECT p.document_id FROM postings p"
+        params = [term_id]
+        conditions = ["p.term_id = ?"]
+        if month_from or month_to:
+            query += " JOIN documents d ON d.id = p.document_id"
+            if month_from:
+                conditions.append("d.month >= ?")
+                params.append(month_from)
+            if month_to:
+                conditions.append("d.month <= ?")
+                params.append(month_to)
+        if candidates is not None and self.lookup(candidates, frequency):
+            conditions.append("p.document_id IN ({})".format(",".join("?" * len(candidates))))
+            params.extend(candidates)
+        query += " WHERE " + " AND ".join(conditions)
+        documents = {document_id for document_id, in self.connection.execute(query, params)}
+        return documents if candidates is None else documents & candidates
+
+    def positions(self, term, candidates):
+        """{document id: positions} of a term in the candidates."""
+        term_id, frequency = term
+        query = "SELECT document_id, positions FROM positions WHERE term_id = ?"
+        params = [term_id]
+        if self.lookup(candidates, frequency):
+            query += " AND document_id IN ({})".format(",".join("?" * len(candidates)))
+            params.extend(candidates)
+        result = {}
+        for document_id, blob in self.connection.execute(query, params):
+            if document_id in candidates:
+                positions = array("I")
+                positions.frombytes(blob)
+                result[document_id] = positions
+        return result
+
+    def search(self, query, month_from=None, month_to=None):
+        """
+        Messages containing all words and phrases of the query, optionally only months in
+        [month_from, month_to] (Ym). Returns the ids of the documents, oldest first, see describe.
+        """
+        phrases = self.parse_query(query)
+        words = {word for phrase in phrases for _, word in phrase}
+        if not words:
+            return []
+        terms = {}
+        for word in words:
+            row = self.connection.execute("SELECT id, documents FROM terms WHERE term = ?", (word,)).fetchone()
+            if row is None:
+                return []
+            terms[word] = row
+
+        # intersect, starting with the rarest word, so the candidates shrink as early as possible,
+        # the month range only has to be applied to the first one
+        candidates = None
+        for word in sorted(words, key=lambda word: terms[word][1]):
+            if candidates is None:
+                candidates = self.postings(terms[word], month_from, month_to, None)
+            else:
+                candidates = self.postings(terms[word], None, None, candidates)
+            if not candidates:
+                return []
+
+        # positions are only needed for the words of phrases, and only of the remaining candidates
+        phrases = [phrase for phrase in phrases if len(phrase) > 1]
+        positions = {word: self.positions(terms[word], candidates) for phrase in phrases for _, word in phrase}
+        matches = [document_id for document_id in candidates
+                   if all(self.contains_phrase(phrase, positions, document_id) for phrase in phrases)]
+        if len(matches) < LOOKUP_CANDIDATES:
+            return [document_id for document_id, in self.connection.execute(
+                "SELECT id FROM documents WHERE id IN ({}) ORDER BY timestamp".format(",".join("?" * len(matches))), matches)]
+        matches = set(matches)
+        return [document_id for document_id, in self.connection.execute("SELECT id FROM documents ORDER BY timestamp")
+                if document_id in matches]
+
+    def describe(self, document_ids):
+        """(timestamp, hexTimestamp) of documents, in the given order."""
+        rows = dict((document_id, (timestamp, hex_timestamp)) for document_id, timestamp, hex_timestamp in self.connection.execute(
+            "SELECT id, timestamp, hex_timestamp FROM documents WHERE id IN ({})".format(",".join("?" * len(document_ids))), document_ids))
+        return [rows[document_id] for document_id in document_ids]
+
+    @staticmethod
+    def contains_phrase(phrase, positions, document_id):
+        (first_offset, first_word), rest = phrase[0], phrase[1:]
+        others = [(offset, set(positions[word][document_id])) for offset, word in rest]
+        for position in positions[first_word][document_id]:
+            start = position - first_offset
+            if all(start + offset in word_positions for offset, word_positions in others):
+                return True
+        return False
+
+
+def main():
+    # the tokenization lives in fefe.py, only the CLI needs it
+    import fefe
+    from message_store import iter_messages
+
+    parser = argparse.ArgumentParser(description="Full-text index over the messages of fefe.py")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="add new and changed messages to the index")
+    build.add_argument("messages", help="messages.json, messages.ndjson or messages.sqlite written by fefe.py")
+
+    search = subparsers.add_parser("search", help="messages containing all words, \"quoted phrases\" have to match as a whole")
+    search.add_argument("query")
+    search.add_argument("--from", dest="month_from", help="first month, format Ym, e.g. 201501")
+    search.add_argument("--to", dest="month_to", help="last month, format Ym, e.g. 201512")
+    search.add_argument("--limit", type=int, default=50, help="number of messages to print, 0 prints all (default: 50)")
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("--index", default="index.sqlite", help="index file (default: index.sqlite)")
+    args = parser.parse_args()
+
+    index = MessageIndex(args.index, fefe.getIndexTerms)
+    started = time.perf_counter()
+    if args.command == "build":
+        updated = index.update(message for _, message in iter_messages(args.messages))
+        print("Indexed {} new or changed messages in {:.1f}s".format(updated, time.perf_counter() - started))
+    else:
+        results = index.search(args.query, args.month_from, args.month_to)
+        elapsed = time.perf_counter() - started
+        for timestamp, hex_timestamp in index.describe(results[:args.limit or None]):
+            print("{}  https://blog.fefe.de/?ts={}".format(timestamp, hex_timestamp))
+        print("{} messages found in {:.1f} ms".format(len(results), 1000 * elapsed))
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
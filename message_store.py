@@ -0,0 +1,321 @@
+"""
+Reading and writing the messages produced by fefe.py without holding a whole
+document in memory.
+
+messages.json is one JSON object {hexTimestamp: message}, messages.ndjson has
+one message per line (the id is the message's own "hexTimestamp" field) and
+messages.sqlite is an indexed store with a table of the external links, which
+allows filtered reads, e.g. all posts of 2015 linking heise.de.
+"""
+
+import json
+import os
+import sqlite3
+
+READ_CHUNK_SIZE = 65536
+
+SQLITE_SCHEMA = """
+CREATE TABLE messages (
+    hex_timestamp TEXT PRIMARY KEY,
+    timestamp TEXT,
+    month TEXT,
+    quote_count INTEGER,
+    word_count INTEGER,
+    sources_count INTEGER,
+    url TEXT,
+    content TEXT,
+    content_html TEXT,
+    external_sources TEXT
+);
+CREATE TABLE links (
+    hex_timestamp TEXT NOT NULL REFERENCES messages (hex_timestamp),
+    url TEXT NOT NULL,
+    domain TEXT,
+    registrable_domain TEXT
+);
+CREATE INDEX messages_timestamp ON messages (timestamp);
+CREATE INDEX messages_month ON messages (month);
+CREATE INDEX links_domain ON links (domain, hex_timestamp);
+CREATE INDEX links_registrable_domain ON links (registrable_domain, hex_timestamp);
+CREATE INDEX links_url ON links (url);
+CREATE INDEX links_message ON links (hex_timestamp);
+"""
+
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+
+# ---------------------------------------------------------------------------
+# Writers
+# ---------------------------------------------------------------------------
+
+
+def open_atomic(file_name):
+    """Open a temporary file next to file_name, see commit_atomic."""
+    return open(file_name + ".tmp", "w", encoding="utf8")
+
+
+def commit_atomic(handle, file_name):
+    """
+    Close a file opened by open_atomic and rename it to file_name, a killed process never
+    leaves a half written file.
+    """
+    handle.flush()
+    os.fsync(handle.fileno())
+    handle.close()
+    os.replace(file_name + ".tmp", file_name)
+
+
+def write_file_atomic(file_name, string):
+    handle = open_atomic(file_name)
+    handle.write(string)
+    commit_atomic(handle, file_name)
+
+
+def _write_json_container(entries, file_name, indent, brackets):
+    """
+    Stream already encoded entries ('"key": value' or 'value') into a JSON object or array,
+    laid out like json.dumps with the same indent.
+    """
+    handle = open_atomic(file_name)
+    if indent is None:
+        separator, newline, pad = ", ", "", ""
+    else:
+        separator, newline, pad = ",", "\n", " " * indent
+
+    empty = True
+    for entry in entries:
+        handle.write(brackets[0] if empty else separator)
+        empty = False
+        if indent is not None:
+            entry = entry.replace("\n", "\n" + pad)
+        handle.write(newline + pad + entry)
+    handle.write(brackets if empty else newline + brackets[1])
+    commit_atomic(handle, file_name)
+
+
+def write_json_object(items, file_name, indent=2):
+    """
+    Stream (key, value) pairs into a JSON object. The result is byte-identical to
+    json.dumps(dict(items), ensure_ascii=False, indent=indent), but only one value is
+    serialized at a time. The file is written next to its destination and renamed.
+    """
+    entries = (json.dumps(str(key), ensure_ascii=False) + ": " + json.dumps(value, ensure_ascii=False, indent=indent)
+               for key, value in items)
+    _write_json_container(entries, file_name, indent, "{}")
+
+
+def write_json_array(values, file_name, indent=2):
+    """
+    Stream values into a JSON array, byte-identical to json.dumps(list(values), ensure_ascii=False,
+    indent=indent). Like write_json_object, the file is written next to its destination and renamed.
+    """
+    entries = (json.dumps(value, ensure_ascii=False, indent=indent) for value in values)
+    _write_json_container(entries, file_name, indent, "[]")
+
+
+def write_ndjson(values, file_name):
+    """Stream values into a file with one compact JSON document per line."""
+    handle = open_atomic(file_name)
+    for value in values:
+        handle.write(json.dumps(value, ensure_ascii=False))
+        handle.write("\n")
+    commit_atomic(handle, file_name)
+
+
+def month_of(timestamp):
+    """'2015-03-01 12:00:00' -> '201503', the month format of fefe.py."""
+    return (timestamp or "")[:7].replace("-", "")
+
+
+def write_sqlite(messages, links, file_name):
+    """
+    Write messages and (hexTimestamp, url, domain, registrable domain) link tuples into a new SQLite store.
+    The database is built next to its destination and renamed when it is complete.
+    """
+    tmp_name = file_name + ".tmp"
+    if os.path.exists(tmp_name):
+        os.remove(tmp_name)
+    connection = sqlite3.connect(tmp_name)
+    connection.executescript(SQLITE_SCHEMA)
+    connection.executemany(
+        "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (
+                message["hexTimestamp"],
+                message["timestamp"],
+                month_of(message["timestamp"]),
+                message["quoteCount"],
+                message["wordCount"],
+                message["sourcesCount"],
+                message["url"],
+                message["content"],
+                message["contentHtml"],
+                json.dumps(message["externalSources"], ensure_ascii=False),
+            )
+            for message in messages
+        ),
+    )
+    connection.executemany("INSERT INTO links VALUES (?, ?, ?, ?)", links)
+    connection.commit()
+    connection.close()
+    os.replace(tmp_name, file_name)
+
+
+# ---------------------------------------------------------------------------
+# Readers
+# ---------------------------------------------------------------------------
+
+
+def iter_ndjson(path):
+    """Yield (hexTimestamp, message) pairs from a messages.ndjson file."""
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if line:
+                message = json.loads(line)
+                yield message.get("hexTimestamp"), message
+
+
+def iter_json_object(path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield the (key, value) pairs of a top-level JSON object one by one. Only the
+    value currently being decoded is kept in memory, not the whole document.
+    A value that does not fit into the buffer is decoded again after the next read,
+    so the reads double in size until it fits, a large value is decoded a few times
+    instead of once per chunk.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as handle:
+        buffer = ""
+        position = 0
+        eof = False
+
+        def fill(size=chunk_size):
+            nonlocal buffer, position, eof
+            chunk = handle.read(size)
+            if not chunk:
+                eof = True
+            buffer = buffer[position:] + chunk
+            position = 0
+
+        def skip_whitespace():
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n":
+                    position += 1
+                if position < len(buffer) or eof:
+                    return
+                fill()
+
+        def expect(chars):
+            nonlocal position
+            skip_whitespace()
+            if position >= len(buffer) or buffer[position] not in chars:
+                raise ValueError("Invalid JSON object in {}: expected one of {!r}".format(path, chars))
+            position += 1
+            return buffer[position - 1]
+
+        def decode():
+            nonlocal position
+            skip_whitespace()
+            size = chunk_size
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                    # a number at the end of the buffer may continue in the next chunk
+                    if end < len(buffer) or eof:
+                        position = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                # read as much as the incomplete value has so far, see the docstring
+                size = max(size, len(buffer) - position)
+                fill(size)
+
+        expect("{")
+        skip_whitespace()
+        if position < len(buffer) and buffer[position] == "}":
+            return
+        while True:
+            key = decode()
+            expect(":")
+            yield key, decode()
+            if expect(",}") == "}":
+                return
+
+
+def iter_sqlite(path, month_from=None, month_to=None, domain=None):
+    """
+    Yield (hexTimestamp, message) pairs from a messages.sqlite store in the order of
+    messages.json, optionally only months in [month_from, month_to] (Ym, e.g. '201503') and
+    only posts linking `domain`, a host (news.bbc.co.uk) or a registrable domain (bbc.co.uk).
+    Messages have the same shape as in messages.json.
+    """
+    query = (
+        "SELECT hex_timestamp, timestamp, quote_count, word_count, sources_count, url, "
+        "content, content_html, external_sources FROM messages"
+    )
+    conditions = []
+    params = []
+    if month_from:
+        conditions.append("month >= ?")
+        params.append(month_from)
+    if month_to:
+        conditions.append("month <= ?")
+        params.append(month_to)
+    if domain:
+        conditions.append(
+            "hex_timestamp IN (SELECT hex_timestamp FROM links WHERE domain = ? UNION "
+            "SELECT hex_timestamp FROM links WHERE registrable_domain = ?)"
+        )
+        params.extend((domain, domain))
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY rowid"
+
+    connection = sqlite3.connect("file:{}?mode=ro".format(path), uri=True)
+    try:
+        for row in connection.execute(query, params):
+            yield row[0], {
+                "timestamp": row[1],
+                "hexTimestamp": row[0],
+                "quoteCount": row[2],
+                "wordCount": row[3],
+                "sourcesCount": row[4],
+                "url": row[5],
+                "content": row[6],
+                "contentHtml": row[7],
+                "externalSources": json.loads(row[8]) if row[8] else [],
+            }
+    finally:
+        connection.close()
+
+
+def _filter_months(pairs, month_from, month_to):
+    for post_id, message in pairs:
+        month = month_of(message.get("timestamp"))
+        if month_from and month < month_from:
+            continue
+        if month_to and month > month_to:
+            continue
+        yield post_id, message
+
+
+def iter_messages(path, month_from=None, month_to=None, domain=None):
+    """
+    Yield (hexTimestamp, message) pairs from messages.json, messages.ndjson or
+    messages.sqlite, optionally filtered by month range (Ym). Filtering by linked
+    domain needs the link table of the SQLite store.
+    """
+    if path.endswith(SQLITE_SUFFIXES):
+        return iter_sqlite(path, month_from, month_to, domain)
+    if domain:
+        raise ValueError("Filtering by domain needs a SQLite store (fefe.py --format sqlite)")
+    if path.endswith(".ndjson") or path.endswith(".jsonl"):
+        pairs = iter_ndjson(path)
+    else:
+        pairs = iter_json_object(path)
+    if month_from or month_to:
+        return _filter_months(pairs, month_from, month_to)
+    return pairs
@@ -0,0 +1,109 @@
+"""
+Timings and counters of a scraper run.
+
+Stages are timed with `timer(stage)` or reported with `add(stage, seconds)`,
+everything else is a counter. Stages running in threads or worker processes
+add up their own time, so the stage seconds can exceed the wall clock time of
+the run. The summary is one JSON document, during the run a line of NDJSON can
+be appended to a log file every few seconds.
+"""
+
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.seconds = Counter()
+        self.calls = Counter()
+        self.counters = Counter()
+        self.log_file = None
+        self.log_interval = None
+        self.last_log = None
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def add(self, stage, seconds, calls=1):
+        with self.lock:
+            self.seconds[stage] += seconds
+            self.calls[stage] += calls
+
+    def add_timings(self, timings):
+        """Add the {stage: seconds} of one unit of work, e.g. a month parsed in a worker process."""
+        with self.lock:
+            for stage, seconds in timings.items():
+                self.seconds[stage] += seconds
+                self.calls[stage] += 1
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        with self.lock:
+            stages = {
+                stage: {
+                    "seconds": round(seconds, 3),
+                    "calls": self.calls[stage],
+                    "share": round(seconds / elapsed, 3) if elapsed else 0,
+                }
+                for stage, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])
+            }
+            counters = dict(self.counters)
+        return {
+            "started": self.started_at,
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "elapsed": round(elapsed, 3),
+            "stages": stages,
+            "counters": counters,
+            "rates": {
+                "messagesParsedPerSecond": round(counters.get("messagesParsed", 0) / elapsed, 1) if elapsed else 0,
+                "monthsParsedPerMinute": round(60 * counters.get("monthsParsed", 0) / elapsed, 2) if elapsed else 0,
+                "bytesFetchedPerSecond": round(counters.get("bytesFetched", 0) / elapsed) if elapsed else 0,
+            },
+        }
+
+    def write_summary(self, file_name):
+        with open(file_name, "w", encoding="utf8") as handle:
+            json.dump(self.summary(), handle, ensure_ascii=False, indent=2)
+
+    def open_log(self, file_name, interval):
+        """Append a summary line to file_name at most every `interval` seconds, see tick."""
+        self.log_file = open(file_name, "a", encoding="utf8")
+        self.log_interval = interval
+        self.last_log = time.perf_counter()
+
+    def tick(self, **fields):
+        """Write a line to the log, if one is open and the interval has passed. Extra fields are added to it."""
+        if self.log_file is None or time.perf_counter() - self.last_log < self.log_interval:
+            return
+        self.write_line(fields)
+
+    def write_line(self, fields):
+        self.last_log = time.perf_counter()
+        line = self.summary()
+        line.update(fields)
+        self.log_file.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self.log_file.flush()
+
+    def close(self, **fields):
+        """Write a last line to the log and close it."""
+        if self.log_file is not None:
+            self.write_line(fields)
+            self.log_file.close()
+            self.log_file = None
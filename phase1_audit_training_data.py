@@ -5,10 +5,12 @@ Audit the prepared training data — reports quality buckets,
 topic sources, suspicious patterns, and example rows per bucket.
 """
 
+import argparse
 import json
 import re
 from collections import Counter, defaultdict
 
+from message_store import iter_messages
 from prompt_template import normalize_whitespace
 
 DATASET_PATH = "prepared/fefe_training_data.json"
@@ -42,9 +44,22 @@ def classify_topic(topic):
 
 
 def main():
-    with open(DATASET_PATH, "r", encoding="utf-8") as handle:
+    parser = argparse.ArgumentParser(description="Audit the prepared training data")
+    parser.add_argument("--input", default=DATASET_PATH, help="Prepared training data")
+    parser.add_argument("--messages", help="Raw messages (e.g. messages.sqlite), to audit only rows of matching posts")
+    parser.add_argument("--from", dest="month_from", help="With --messages: only posts from this month on, format Ym")
+    parser.add_argument("--to", dest="month_to", help="With --messages: only posts up to this month, format Ym")
+    parser.add_argument("--domain", help="With --messages: only posts linking this domain (needs messages.sqlite)")
+    args = parser.parse_args()
+
+    with open(args.input, "r", encoding="utf-8") as handle:
         dataset = json.load(handle)
 
+    if args.messages:
+        post_ids = {post_id for post_id, _ in iter_messages(args.messages, args.month_from, args.month_to, args.domain)}
+        dataset = [row for row in dataset if row.get("post_id") in post_ids]
+        print("Restricted to {} rows of {} matching posts".format(len(dataset), len(post_ids)))
+
     bucket_counts = Counter()
     bucket_examples = defaultdict(list)
     quality_buckets = Counter()
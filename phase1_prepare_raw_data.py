@@ -8,15 +8,26 @@ quality scoring with weighted sampling (P0.4), and language detection (P1.3).
 """
 
 import argparse
+import hashlib
+import inspect
 import json
 import math
 import random
 import re
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
 
 from bs4 import BeautifulSoup
-from langdetect import detect, LangDetectException
 
+from domain_names import host_of
+import flat_html
+from flat_html import FlatDocument
+import language_detection
+from language_detection import LanguageDetector
+from message_store import iter_messages, write_json_array
 from prompt_template import normalize_whitespace
 
 # ---------------------------------------------------------------------------
@@ -25,6 +36,17 @@ from prompt_template import normalize_whitespace
 
 MIN_COMMENT_LENGTH = 30
 
+# posts handed to a worker process at once with --jobs
+CHUNK_SIZE = 250
+# the fields of a post process_post looks at, only these are sent to the worker processes
+POST_FIELDS = ("content", "contentHtml", "externalSources", "timestamp", "url")
+
+# bump when the topic extraction or language detection changes in a way extractor_fingerprint does not see
+EXTRACTOR_VERSION = 1
+
+# backends of build_topic_context_from_html: a BeautifulSoup tree, or the flat event stream of flat_html.py
+EXTRACTORS = ("bs4", "stream")
+
 DEICTIC = re.compile(r"\b(das hier|dies|hier|was das|was das hier)\b", re.I)
 MAPS_URL = re.compile(r"google\.(de|com)/maps", re.I)
 MAPS_BOILER = re.compile(
@@ -105,9 +127,27 @@ def next_sentence_after(a_tag, max_chars=140):
 # ---------------------------------------------------------------------------
 
 
+# replaced by configure_extractor
+extractor = "bs4"
+
+
+def configure_extractor(name):
+    """Select the backend of build_topic_context_from_html, one of EXTRACTORS, see configure_worker."""
+    global extractor
+    extractor = name
+
+
 def build_topic_context_from_html(content_html, external_title="", external_desc=""):
-    soup = BeautifulSoup(content_html, "html.parser")
-    anchors = first_external_anchors(soup)
+    if extractor == "stream":
+        # same anchors, blockquotes and sentences as with the tree, see flat_html.py
+        document = FlatDocument.parse(content_html)
+        anchors = [(attrs.get("href"), document.text(index), index)
+                   for index, attrs in document.anchors if is_external_link(attrs)]
+        blockquote_after, sentence_after = document.nearest_blockquote_after, document.next_sentence_after
+    else:
+        soup = BeautifulSoup(content_html, "html.parser")
+        anchors = first_external_anchors(soup)
+        blockquote_after, sentence_after = nearest_blockquote_after, next_sentence_after
 
     topic = ""
     context = ""
@@ -118,14 +158,14 @@ def build_topic_context_from_html(content_html, external_title="", external_desc
         topic = text1
         source = "html_anchor"
 
-        bq = nearest_blockquote_after(a1)
+        bq = blockquote_after(a1)
         if bq and 20 <= len(bq) <= 140:
             topic = "{}: {}".format(topic, bq)
             source = "html_anchor+blockquote"
 
         # Deictic resolution (P1.2)
         if DEICTIC.search(text1):
-            extra = next_sentence_after(a1)
+            extra = sentence_after(a1)
             if extra and len(extra) >= 20:
                 topic = "{} {}".format(text1, extra)
                 source = "html_text"
@@ -136,7 +176,7 @@ def build_topic_context_from_html(content_html, external_title="", external_desc
         # Maps special-case (P1.2)
         if MAPS_URL.search(url1 or ""):
             if MAPS_BOILER.search(topic) or len(topic) < 40:
-                extra = next_sentence_after(a1)
+                extra = sentence_after(a1)
                 if extra and len(extra) >= 20:
                     topic = extra
                     source = "html_text"
@@ -163,20 +203,32 @@ def build_topic_context_from_html(content_html, external_title="", external_desc
 # ---------------------------------------------------------------------------
 
 
-def detect_language(text):
-    if not text or len(text) < 20:
-        return "de"
-    try:
-        lang = detect(text)
-        return lang
-    except LangDetectException:
-        return "de"
+# memoized and seeded, see language_detection.py, replaced by configure_language_detection
+language_detector = LanguageDetector()
 
 
-def add_language_prefix(context, topic):
-    """If the topic/context appears non-German, prepend [Quelle: XX]."""
+def configure_language_detection(domain_hint):
+    """Set up the language detector, see configure_worker."""
+    global language_detector
+    language_detector = LanguageDetector(domain_hint=domain_hint)
+
+
+def topic_language(context, topic, url="", stats=None):
+    """
+    Language of a topic (with its context if the topic is short). How the language was
+    found (see LanguageDetector.detect) is counted in stats["language"].
+    """
     sample = topic if len(topic) >= 40 else "{} {}".format(topic, context)
-    lang = detect_language(sample)
+    lang, method = language_detector.detect(sample, host_of(url) if url else None)
+    if stats is not None:
+        stats["language"][method] = stats["language"].get(method, 0) + 1
+    return lang
+
+
+def add_language_prefix(context, topic, url="", stats=None, lang=None):
+    """If the topic/context appears non-German, prepend [Quelle: XX]."""
+    if lang is None:
+        lang = topic_language(context, topic, url, stats)
     if lang != "de":
         prefix = "[Quelle: {}]".format(lang.upper())
         if context:
@@ -275,7 +327,7 @@ def quality_bucket(score):
 
 
 def apply_weighted_sampling(rows):
-    """Repeat rows based on quality bucket: high=3x, mid=1x, low=0.5x."""
+    """Repeat rows (any iterable) based on quality bucket: high=3x, mid=1x, low=0.5x."""
     result = []
     for row in rows:
         bucket = row["quality_bucket"]
@@ -290,6 +342,72 @@ def apply_weighted_sampling(rows):
     return result
 
 
+# ---------------------------------------------------------------------------
+# Extraction cache
+# ---------------------------------------------------------------------------
+
+
+def extractor_fingerprint(domain_hint, extractor_name="bs4"):
+    """
+    Hash over the code and settings the cached extractions depend on. Changing one of the
+    extraction functions, flat_html.py or language_detection.py invalidates the cache, changing
+    the scoring or sampling does not.
+    """
+    parts = [str(EXTRACTOR_VERSION), str(domain_hint), extractor_name, DEICTIC.pattern, MAPS_URL.pattern, MAPS_BOILER.pattern]
+    for code in (is_external_link, first_external_anchors, nearest_blockquote_after, next_sentence_after,
+                 build_topic_context_from_html, topic_language, normalize_whitespace, flat_html, language_detection):
+        parts.append(inspect.getsource(code))
+    return hashlib.sha256("\0".join(parts).encode("utf8")).hexdigest()
+
+
+class ExtractionCache:
+    """
+    The expensive part of processing a post, [topic, context, topic_source, language], in a
+    SQLite file. Entries are keyed by a hash of their inputs (contentHtml, external title and
+    description, source url) and the extractor fingerprint. When the fingerprint changes,
+    the cache is emptied. Lookups and writes happen in the main process only.
+    """
+
+    def __init__(self, path, fingerprint):
+        self.fingerprint = fingerprint
+        self.pending = []
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS extractions (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);"
+        )
+        row = self.connection.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            with self.connection:
+                self.connection.execute("DELETE FROM extractions")
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+
+    def key(self, *inputs):
+        digest = hashlib.sha256(self.fingerprint.encode("utf8"))
+        for value in inputs:
+            digest.update(b"\0" + (value or "").encode("utf8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        row = self.connection.execute("SELECT value FROM extractions WHERE key = ?", (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, key, extraction):
+        self.pending.append((key, json.dumps(extraction, ensure_ascii=False)))
+        if len(self.pending) >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO extractions VALUES (?, ?)", self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
 # ---------------------------------------------------------------------------
 # Main pipeline
 # ---------------------------------------------------------------------------
@@ -305,104 +423,234 @@ def pick_best_external(sources):
     return "", ""
 
 
-def process_posts(raw_data):
-    training_data = []
-    stats = {
+def new_stats():
+    return {
         "total_posts": 0,
         "skipped_short_comment": 0,
         "skipped_no_topic": 0,
         "dropped": {},
         "buckets": {"high": 0, "mid": 0, "low": 0},
         "sources": {},
+        "language": {},
+        "extraction_cache": {},
     }
 
-    for post_id, post in raw_data.items():
-        stats["total_posts"] += 1
 
-        target_comment = normalize_whitespace(post.get("content", ""))
-        if len(target_comment) < MIN_COMMENT_LENGTH:
-            stats["skipped_short_comment"] += 1
-            continue
+def merge_stats(total, stats):
+    """Add the counts of stats to total, nested dictionaries are merged key by key."""
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            merge_stats(total.setdefault(key, {}), value)
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
 
-        content_html = post.get("contentHtml", "")
-        sources = post.get("externalSources", []) or []
-        ext_title, ext_desc = pick_best_external(sources)
 
-        topic, context, topic_source = build_topic_context_from_html(
-            content_html, ext_title, ext_desc
-        )
-
-        if not topic:
-            stats["skipped_no_topic"] += 1
-            continue
+def first_source_url(post):
+    sources = post.get("externalSources", []) or []
+    if sources:
+        return normalize_whitespace(sources[0].get("url", ""))
+    return ""
 
-        # Hard-drop check (P0.3)
-        drop_reason = check_hard_drop(topic)
-        if drop_reason:
-            stats["dropped"][drop_reason] = stats["dropped"].get(drop_reason, 0) + 1
-            continue
 
-        # Language prefix (P1.3)
-        context = add_language_prefix(context, topic)
+def process_post(post_id, post, stats, extraction=None):
+    """
+    Turn one post into a training row, None if it is skipped or dropped (counted in stats).
+    Returns (row, extraction), extraction is [topic, context, topic_source, language] for the
+    ExtractionCache, a cached one can be passed in. The language is only detected for topics
+    that are not dropped, it stays None otherwise.
+    """
+    stats["total_posts"] += 1
 
-        # Quality scoring (P0.4)
-        score = compute_quality_score(topic, context)
-        bucket = quality_bucket(score)
+    target_comment = normalize_whitespace(post.get("content", ""))
+    if len(target_comment) < MIN_COMMENT_LENGTH:
+        stats["skipped_short_comment"] += 1
+        return None, None
 
-        if bucket == "drop":
-            stats["dropped"]["quality_drop"] = stats["dropped"].get("quality_drop", 0) + 1
+    url = first_source_url(post)
+    if extraction is None:
+        content_html = post.get("contentHtml", "")
+        ext_title, ext_desc = pick_best_external(post.get("externalSources", []))
+        extraction = list(build_topic_context_from_html(content_html, ext_title, ext_desc)) + [None]
+    else:
+        extraction = list(extraction)
+    topic, context, topic_source, language = extraction
+
+    if not topic:
+        stats["skipped_no_topic"] += 1
+        return None, extraction
+
+    # Hard-drop check (P0.3)
+    drop_reason = check_hard_drop(topic)
+    if drop_reason:
+        stats["dropped"][drop_reason] = stats["dropped"].get(drop_reason, 0) + 1
+        return None, extraction
+
+    # Language prefix (P1.3)
+    if language is None:
+        language = extraction[3] = topic_language(context, topic, url, stats)
+    context = add_language_prefix(context, topic, lang=language)
+
+    # Quality scoring (P0.4)
+    score = compute_quality_score(topic, context)
+    bucket = quality_bucket(score)
+
+    if bucket == "drop":
+        stats["dropped"]["quality_drop"] = stats["dropped"].get("quality_drop", 0) + 1
+        return None, extraction
+
+    stats["buckets"][bucket] = stats["buckets"].get(bucket, 0) + 1
+    stats["sources"][topic_source] = stats["sources"].get(topic_source, 0) + 1
+
+    return {
+        "topic": topic,
+        "context": context,
+        "url": url,
+        "target_comment": target_comment,
+        "timestamp": post.get("timestamp"),
+        "post_url": post.get("url"),
+        "post_id": post_id,
+        "topic_source": topic_source,
+        "quality_score": round(score, 3),
+        "quality_bucket": bucket,
+    }, extraction
+
+
+def configure_worker(domain_hint, extractor_name):
+    """Initializer of the worker processes, they get the settings of the main process."""
+    configure_language_detection(domain_hint)
+    configure_extractor(extractor_name)
+
+
+def process_chunk(items):
+    """
+    Process (post_id, post, cached extraction) triples in one go.
+    Returns (training rows, stats, extractions), the extractions in the order of the items.
+    """
+    training_data = []
+    extractions = []
+    stats = new_stats()
+    for post_id, post, cached in items:
+        row, extraction = process_post(post_id, post, stats, cached)
+        extractions.append(extraction)
+        if row is not None:
+            training_data.append(row)
+    return training_data, stats, extractions
+
+
+def lookup_extractions(posts, cache, stats):
+    """(post_id, post, key, cached extraction) for (post_id, post) pairs, key and extraction are None without a cache."""
+    for post_id, post in posts:
+        # posts process_post skips before the extraction are not looked up either
+        if cache is None or len(normalize_whitespace(post.get("content", ""))) < MIN_COMMENT_LENGTH:
+            yield post_id, post, None, None
             continue
-
-        stats["buckets"][bucket] = stats["buckets"].get(bucket, 0) + 1
-        stats["sources"][topic_source] = stats["sources"].get(topic_source, 0) + 1
-
-        # Extract URL from first external source
-        url = ""
-        if sources:
-            url = normalize_whitespace(sources[0].get("url", ""))
-
-        training_data.append({
-            "topic": topic,
-            "context": context,
-            "url": url,
-            "target_comment": target_comment,
-            "timestamp": post.get("timestamp"),
-            "post_url": post.get("url"),
-            "post_id": post_id,
-            "topic_source": topic_source,
-            "quality_score": round(score, 3),
-            "quality_bucket": bucket,
-        })
-
-    return training_data, stats
+        ext_title, ext_desc = pick_best_external(post.get("externalSources", []))
+        key = cache.key(post.get("contentHtml", ""), ext_title, ext_desc, first_source_url(post))
+        cached = cache.get(key)
+        outcome = "misses" if cached is None else "hits"
+        stats["extraction_cache"][outcome] = stats["extraction_cache"].get(outcome, 0) + 1
+        yield post_id, post, key, cached
+
+
+def store_extraction(cache, key, cached, extraction):
+    if cache is not None and extraction is not None and extraction != cached:
+        cache.put(key, extraction)
+
+
+def iter_chunks(items, size):
+    """Lists of up to size items of lookup_extractions, posts reduced to POST_FIELDS."""
+    items = iter(items)
+    while True:
+        chunk = [(post_id, {field: post[field] for field in POST_FIELDS if field in post}, key, cached)
+                 for post_id, post, key, cached in islice(items, size)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_training_rows(posts, stats, jobs=1, cache=None):
+    """
+    Yield the training rows of (post_id, post) pairs, e.g. from message_store.iter_messages,
+    skipped and dropped posts are counted in stats (see new_stats). Only the post at hand is
+    held in memory. With more than one job, chunks of posts are processed by a pool of worker
+    processes, rows and stats are collected in the order of the posts, so the result is the
+    same as the serial one. With an ExtractionCache, posts seen before skip the extraction.
+    """
+    items = lookup_extractions(posts, cache, stats)
+    if jobs <= 1:
+        for post_id, post, key, cached in items:
+            row, extraction = process_post(post_id, post, stats, cached)
+            store_extraction(cache, key, cached, extraction)
+            if row is not None:
+                yield row
+        return
+
+    def collect(chunk, future):
+        rows, chunk_stats, extractions = future.result()
+        merge_stats(stats, chunk_stats)
+        for (_, _, key, cached), extraction in zip(chunk, extractions):
+            store_extraction(cache, key, cached, extraction)
+        return rows
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=configure_worker,
+                             initargs=(language_detector.domain_hint, extractor)) as executor:
+        # keep at most 2 * jobs chunks in flight, so the posts are still read as a stream
+        pending = deque()
+        for chunk in iter_chunks(items, CHUNK_SIZE):
+            work = [(post_id, post, cached) for post_id, post, _, cached in chunk]
+            pending.append((chunk, executor.submit(process_chunk, work)))
+            if len(pending) < 2 * jobs:
+                continue
+            yield from collect(*pending.popleft())
+        while pending:
+            yield from collect(*pending.popleft())
 
 
 def main():
     parser = argparse.ArgumentParser(description="Prepare Fefe training data with HTML-first extraction")
-    parser.add_argument("--input", default="messages.json", help="Raw messages JSON")
+    parser.add_argument("--input", default="messages.json", help="Raw messages: messages.json, messages.ndjson or messages.sqlite (read as a stream)")
+    parser.add_argument("--from", dest="month_from", help="Only posts from this month on, format Ym, e.g. 201501")
+    parser.add_argument("--to", dest="month_to", help="Only posts up to this month, format Ym, e.g. 201512")
+    parser.add_argument("--domain", help="Only posts linking this domain (needs messages.sqlite)")
     parser.add_argument("--output", default="prepared/fefe_training_data.json", help="Output path")
     parser.add_argument("--no-weighted-sampling", action="store_true", help="Disable weighted sampling (uniform)")
     parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--language-domain-hint", action="store_true",
+                        help="Take topics whose language is unclear as German if the source is on .de or .at, saves langdetect calls")
+    parser.add_argument("--cache", default="prepared/extraction_cache.sqlite",
+                        help="SQLite file caching topic extraction and language detection per post, empty string disables it "
+                             "(default: prepared/extraction_cache.sqlite)")
+    parser.add_argument("--extractor", choices=EXTRACTORS, default="bs4",
+                        help="HTML backend of the topic extraction, 'stream' skips building a BeautifulSoup tree per post, "
+                             "the topics are the same, see ./benchmark.py extractor (default: bs4)")
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes, the output is the same for any number (default: 1)")
     args = parser.parse_args()
 
     random.seed(args.seed)
+    configure_language_detection(args.language_domain_hint)
+    configure_extractor(args.extractor)
+    cache = ExtractionCache(args.cache, extractor_fingerprint(args.language_domain_hint, args.extractor)) if args.cache else None
 
-    with open(args.input, "r", encoding="utf-8") as f:
-        raw_data = json.load(f)
-
-    training_data, stats = process_posts(raw_data)
+    # posts are read, processed and sampled as a stream, only the rows are collected for the shuffle
+    posts = iter_messages(args.input, args.month_from, args.month_to, args.domain)
+    stats = new_stats()
+    rows = iter_training_rows(posts, stats, args.jobs, cache)
 
     # Weighted sampling
     if not args.no_weighted_sampling:
-        before_count = len(training_data)
-        training_data = apply_weighted_sampling(training_data)
-        print("Weighted sampling: {} -> {} rows".format(before_count, len(training_data)))
+        training_data = apply_weighted_sampling(rows)
+        print("Weighted sampling: {} -> {} rows".format(sum(stats["buckets"].values()), len(training_data)))
+    else:
+        training_data = list(rows)
+
+    if cache is not None:
+        cache.close()
 
     random.shuffle(training_data)
 
     Path(args.output).parent.mkdir(exist_ok=True)
-    with open(args.output, "w", encoding="utf-8") as f:
-        json.dump(training_data, f, ensure_ascii=False, indent=2)
+    write_json_array(training_data, args.output)
 
     # Report
     print("Total posts: {}".format(stats["total_posts"]))
@@ -417,6 +665,14 @@ def main():
     print("Topic sources:")
     for source, count in sorted(stats["sources"].items(), key=lambda x: -x[1]):
         print("  {}: {}".format(source, count))
+    if stats["extraction_cache"]:
+        print("Extraction cache: {} hits, {} misses".format(
+            stats["extraction_cache"].get("hits", 0), stats["extraction_cache"].get("misses", 0)))
+    language_calls = sum(stats["language"].values())
+    print("Language detection: {} calls, {} short-circuited".format(
+        language_calls, language_calls - stats["language"].get("langdetect", 0)))
+    for method, count in sorted(stats["language"].items(), key=lambda x: -x[1]):
+        print("  {}: {}".format(method, count))
     print("Final training rows: {}".format(len(training_data)))
 
 
@@ -0,0 +1,219 @@
+#!./.venv/bin/python3
+
+"""
+Trend analytics over the monthly aggregates of fefe.py (words.json, domains.json).
+
+The aggregates are loaded into a dense month x term count matrix, all queries
+are vectorized NumPy operations on it. The matrix is cached next to the JSON
+file (words.5.npz for --min-count 5), so repeated queries don't parse the JSON again:
+
+    ./trends.py words.json --term überwachung
+    ./trends.py domains.json --top 10 --month 201503
+    ./trends.py words.json --rising 20 --window 12
+    ./trends.py domains.json --share heise.de
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+DEFAULT_MIN_COUNT = 5
+
+
+# ---------------------------------------------------------------------------
+# Loading
+# ---------------------------------------------------------------------------
+
+
+def load_aggregates(path, min_count=DEFAULT_MIN_COUNT, use_cache=True):
+    """
+    Load words.json / domains.json into (months, terms, counts, month_totals):
+    months sorted (Ym), terms with at least min_count occurrences overall, counts
+    as int32 matrix [month, term] and the total of all terms per month (including
+    the rare ones dropped from the matrix, so frequencies stay comparable).
+    """
+    cache_path = "{}.{}.npz".format(os.path.splitext(path)[0], min_count)
+    if use_cache and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        cached = np.load(cache_path, allow_pickle=False)
+        return list(cached["months"]), list(cached["terms"]), cached["counts"], cached["month_totals"]
+
+    # every month goes into the matrix, so the whole file is read at once
+    with open(path, "r", encoding="utf-8") as handle:
+        monthly = json.load(handle)
+    if "sum" not in monthly:
+        raise ValueError("{} has no 'sum' entry, is it an output of fefe.py?".format(path))
+    terms = sorted(term for term, count in monthly.pop("sum").items() if count >= min_count)
+
+    months = sorted(monthly)
+    term_index = {term: index for index, term in enumerate(terms)}
+    counts = np.zeros((len(months), len(terms)), dtype=np.int32)
+    month_totals = np.zeros(len(months), dtype=np.int64)
+    for row, month in enumerate(months):
+        month_counts = monthly.pop(month)
+        month_totals[row] = sum(month_counts.values())
+        columns = [term_index[term] for term in month_counts if term in term_index]
+        values = [month_counts[term] for term in month_counts if term in term_index]
+        counts[row, columns] = values
+
+    if use_cache:
+        np.savez(cache_path, months=np.array(months), terms=np.array(terms), counts=counts, month_totals=month_totals)
+    return months, terms, counts, month_totals
+
+
+# ---------------------------------------------------------------------------
+# Vectorized analytics
+# ---------------------------------------------------------------------------
+
+
+def normalized(counts, month_totals, per=1_000_000):
+    """Frequency per `per` terms of the month, months without any terms are 0."""
+    totals = np.where(month_totals > 0, month_totals, 1).astype(np.float64)
+    if counts.ndim > 1:
+        totals = totals[:, None]
+    return counts / totals * per
+
+
+def top_n(values, n):
+    """Indices of the n largest values of a 1-d array, largest first."""
+    n = min(n, values.shape[0])
+    if n <= 0:
+        return np.array([], dtype=np.int64)
+    candidates = np.argpartition(-values, n - 1)[:n]
+    return candidates[np.argsort(-values[candidates], kind="stable")]
+
+
+def rolling_mean(matrix, window):
+    """Trailing mean over `window` months along axis 0 (shorter windows at the start)."""
+    cumulative = np.cumsum(matrix, axis=0, dtype=np.float64)
+    shifted = np.zeros_like(cumulative)
+    shifted[window:] = cumulative[:-window]
+    sizes = np.minimum(np.arange(1, matrix.shape[0] + 1), window).astype(np.float64)
+    if matrix.ndim > 1:
+        sizes = sizes[:, None]
+    return (cumulative - shifted) / sizes
+
+
+def rising(frequencies, window):
+    """
+    Change of the mean frequency in the last `window` months compared to the
+    `window` months before, per term. Returns (ratio, difference).
+    """
+    recent = frequencies[-window:].mean(axis=0)
+    before = frequencies[-2 * window:-window].mean(axis=0) if frequencies.shape[0] > window else np.zeros_like(recent)
+    return (recent + 1.0) / (before + 1.0), recent - before
+
+
+def bursts(frequencies, window, threshold=3.0):
+    """
+    Z-score of every month against the mean and standard deviation of the `window`
+    months before it. Returns (zscores, mask of months above threshold).
+    """
+    mean = rolling_mean(frequencies, window)
+    mean_sq = rolling_mean(frequencies ** 2, window)
+    # statistics of the months *before* the current one
+    previous_mean = np.concatenate([np.zeros_like(mean[:1]), mean[:-1]])
+    previous_sq = np.concatenate([np.zeros_like(mean_sq[:1]), mean_sq[:-1]])
+    std = np.sqrt(np.maximum(previous_sq - previous_mean ** 2, 0.0))
+    zscores = (frequencies - previous_mean) / np.where(std > 0, std, np.inf)
+    zscores[:min(window, zscores.shape[0])] = 0.0
+    return zscores, zscores >= threshold
+
+
+def yearly(counts, months):
+    """Sum the month rows per year. Returns (years, matrix [year, term])."""
+    years = [month[:4] for month in months]
+    starts = [index for index, year in enumerate(years) if index == 0 or year != years[index - 1]]
+    return [years[index] for index in starts], np.add.reduceat(counts, starts, axis=0)
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+
+def print_term(term, months, terms, counts, month_totals, window, threshold):
+    if term not in terms:
+        print("'{}' is not in the vocabulary (or below --min-count)".format(term))
+        return
+    column = terms.index(term)
+    frequencies = normalized(counts[:, column], month_totals)
+    trend = rolling_mean(frequencies, window)
+    zscores, burst_mask = bursts(frequencies, window, threshold)
+    print("{:<8} {:>8} {:>12} {:>12} {:>7}".format("month", "count", "per million", "rolling", "z"))
+    for row, month in enumerate(months):
+        print("{:<8} {:>8} {:>12.1f} {:>12.1f} {:>7.2f}{}".format(
+            month, counts[row, column], frequencies[row], trend[row], zscores[row], "  burst" if burst_mask[row] else ""))
+
+
+def print_top(month, n, months, terms, counts, month_totals):
+    if month:
+        if month not in months:
+            print("No data for month {}".format(month))
+            return
+        values = counts[months.index(month)]
+        total = month_totals[months.index(month)]
+    else:
+        values = counts.sum(axis=0)
+        total = month_totals.sum()
+    for index in top_n(values, n):
+        print("{:<40} {:>10} {:>8.3f}%".format(terms[index], values[index], 100.0 * values[index] / total if total else 0))
+
+
+def print_rising(n, window, months, terms, counts, month_totals):
+    ratio, difference = rising(normalized(counts, month_totals), window)
+    print("Rising over the last {} months (frequency per million, ratio to the {} months before):".format(window, window))
+    for index in top_n(difference, n):
+        print("{:<40} {:>+10.1f} {:>8.2f}x".format(terms[index], difference[index], ratio[index]))
+
+
+def print_share(term, months, terms, counts, month_totals):
+    if term not in terms:
+        print("'{}' is not in the vocabulary (or below --min-count)".format(term))
+        return
+    years, per_year = yearly(counts, months)
+    _, totals = yearly(month_totals, months)
+    column = terms.index(term)
+    for row, year in enumerate(years):
+        share = 100.0 * per_year[row, column] / totals[row] if totals[row] else 0
+        print("{} {:>8} {:>8.3f}%".format(year, per_year[row, column], share))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trends of words and domains in fefe.py aggregates")
+    parser.add_argument("input", help="words.json or domains.json written by fefe.py")
+    parser.add_argument("--term", help="time series, rolling mean and bursts of a word or domain")
+    parser.add_argument("--top", type=int, help="top n terms of --month (or of all months)")
+    parser.add_argument("--month", help="month for --top, format Ym")
+    parser.add_argument("--rising", type=int, help="n terms with the largest increase over the last --window months")
+    parser.add_argument("--share", help="share of a word or domain per year")
+    parser.add_argument("--window", type=int, default=12, help="months for rolling means, trends and bursts (default: 12)")
+    parser.add_argument("--threshold", type=float, default=3.0, help="z-score of a burst (default: 3.0)")
+    parser.add_argument("--min-count", type=int, default=DEFAULT_MIN_COUNT, help="ignore terms with fewer occurrences overall (default: 5)")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write the .npz matrix cache")
+    args = parser.parse_args()
+    if args.window < 1:
+        parser.error("--window has to be at least 1")
+
+    started = time.perf_counter()
+    months, terms, counts, month_totals = load_aggregates(args.input, args.min_count, not args.no_cache)
+    loaded = time.perf_counter()
+
+    if args.term:
+        print_term(args.term, months, terms, counts, month_totals, args.window, args.threshold)
+    if args.top:
+        print_top(args.month, args.top, months, terms, counts, month_totals)
+    if args.rising:
+        print_rising(args.rising, args.window, months, terms, counts, month_totals)
+    if args.share:
+        print_share(args.share, months, terms, counts, month_totals)
+
+    finished = time.perf_counter()
+    print("({} months x {} terms, loaded in {:.0f} ms, query took {:.1f} ms)".format(
+        len(months), len(terms), 1000 * (loaded - started), 1000 * (finished - loaded)))
+
+
+if __name__ == "__main__":
+    main()